@@ -1,4 +1,4 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import cv2
@@ -9,14 +9,30 @@ from io import BytesIO
 from PIL import Image
 import os
 import shutil
+import uuid
+import math
+import random
+import asyncio
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-import tensorflow as tf
-from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-from tensorflow.keras.models import Model
+try:
+    import tensorflow as tf
+    from tensorflow.keras.applications import MobileNetV2
+    from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+    from tensorflow.keras.models import Model
+except ImportError:  # Χωρίς tensorflow: μόνο CNN-free mode (color, gabor, pixel metrics)
+    tf = None
 
 from PIL import Image # gia debug
 
+try:
+    import fcntl
+except ImportError:  # Windows: χωρίς file locks, μόνο ένας worker process
+    fcntl = None
+
 
 app = FastAPI()
 
@@ -28,10 +44,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Φόρτωση MobileNetV2 model (φορτώνεται μία φορά κατά την εκκίνηση)
-print("Loading MobileNetV2 model...")
-base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-
 # Επιλογή intermediate layers για feature extraction
 # Παίρνουμε features από διάφορα depths του network
 layer_names = [
@@ -42,10 +54,32 @@ layer_names = [
     'out_relu'               # Final features (7x7)
 ]
 
-# Δημιουργία feature extractor model
-layer_outputs = [base_model.get_layer(name).output for name in layer_names]
-feature_extractor = Model(inputs=base_model.input, outputs=layer_outputs)
-print(f"MobileNetV2 loaded with {len(layer_names)} intermediate layers")
+if tf is not None:
+    # Φόρτωση MobileNetV2 model (φορτώνεται μία φορά κατά την εκκίνηση)
+    print("Loading MobileNetV2 model...")
+    base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+
+    # Δημιουργία feature extractor model
+    layer_outputs = [base_model.get_layer(name).output for name in layer_names]
+    feature_extractor = Model(inputs=base_model.input, outputs=layer_outputs)
+    print(f"MobileNetV2 loaded with {len(layer_names)} intermediate layers")
+
+    # Channels και σχετικό βάθος (0-1) ανά layer (για το cost model)
+    layer_channels = {name: int(base_model.get_layer(name).output.shape[-1]) for name in layer_names}
+    layer_depth = {
+        name: (base_model.layers.index(base_model.get_layer(name)) + 1) / len(base_model.layers)
+        for name in layer_names
+    }
+
+    # Feature extractors για υποσύνολα των layers - το Model κρατά μόνο όσα layers
+    # χρειάζονται για τα outputs, οπότε χωρίς τα βαθιά layers είναι φθηνότερο
+    feature_extractors = {tuple(layer_names): feature_extractor}
+else:
+    print("TensorFlow not installed - CNN features disabled")
+    base_model = None
+    layer_channels = {}
+    layer_depth = {}
+    feature_extractors = {}
 
 class Item(BaseModel):
     name: str
@@ -65,77 +99,265 @@ def receive_data(item: Item):
     return {"received": item.dict(), "status": "success"}
 
 
-def calculate_color_histogram(image_region, bins=256):
+# Σειρά των borders και των rotations που χρησιμοποιείται στα stacked arrays
+BORDER_NAMES = ['top', 'right', 'bottom', 'left']
+ROTATION_ANGLES = [0, 90, 180, 270]
+
+# Ποιο border του αρχικού (0°) tile γίνεται κάθε border μετά από clockwise rotation.
+# Π.χ. στις 90° το νέο 'top' είναι το παλιό 'left'.
+ROTATED_BORDER_SOURCE = {
+    0: {'top': 'top', 'right': 'right', 'bottom': 'bottom', 'left': 'left'},
+    90: {'top': 'left', 'right': 'top', 'bottom': 'right', 'left': 'bottom'},
+    180: {'top': 'bottom', 'right': 'left', 'bottom': 'top', 'left': 'right'},
+    270: {'top': 'right', 'right': 'bottom', 'bottom': 'left', 'left': 'top'}
+}
+
+# Μέγιστος αριθμός pixels ανά vectorized pass (περιορίζει το peak memory)
+HISTOGRAM_CHUNK_PIXELS = 1 << 22
+
+
+def calculate_color_histograms_batch(regions, bins=256):
     """
-    Υπολογίζει color histogram για μια περιοχή εικόνας (BGR).
+    Υπολογίζει color histograms για πολλές περιοχές εικόνας (BGR) με ένα
+    vectorized pass (offset bincount) αντί για ξεχωριστά cv2.calcHist calls.
 
     Args:
-        image_region: numpy array με shape (height, width, 3) - BGR (OpenCV format)
+        regions: list από numpy arrays με shape (height, width, 3) - BGR ή grayscale
         bins: αριθμός bins για το histogram (default: 256)
 
     Returns:
-        dict με histograms για R, G, B κανάλια (normalized) - σε RGB σειρά
+        numpy float32 array με shape (len(regions), 3, bins) - normalized, σε RGB σειρά
     """
-    if len(image_region.shape) == 2:
-        # Grayscale - μετατροπή σε BGR
-        image_region = cv2.cvtColor(image_region, cv2.COLOR_GRAY2BGR)
-
-    # OpenCV αποθηκεύει σε BGR format, οπότε:
-    # channel 0 = Blue, channel 1 = Green, channel 2 = Red
-    hist_b = cv2.calcHist([image_region], [0], None, [bins], [0, 256])
-    hist_g = cv2.calcHist([image_region], [1], None, [bins], [0, 256])
-    hist_r = cv2.calcHist([image_region], [2], None, [bins], [0, 256])
+    histograms = np.zeros((len(regions), 3, bins), dtype=np.float32)
+
+    # Lookup table: τιμή pixel -> bin (ίδια διαμέριση με cv2.calcHist στο [0, 256))
+    bin_lut = ((np.arange(256, dtype=np.int64) * bins) >> 8).astype(np.int32)
+    # BGR κανάλι -> θέση στο RGB histogram
+    channel_offsets = np.array([2, 1, 0], dtype=np.int32) * bins
+
+    start = 0
+    while start < len(regions):
+        # Μαζεύουμε περιοχές μέχρι να φτάσουμε το pixel budget του pass
+        chunk_pixels = []
+        chunk_sizes = []
+        total_pixels = 0
+        end = start
+        while end < len(regions) and (end == start or total_pixels < HISTOGRAM_CHUNK_PIXELS):
+            region = regions[end]
+            if len(region.shape) == 2:
+                # Grayscale - μετατροπή σε BGR
+                region = cv2.cvtColor(region, cv2.COLOR_GRAY2BGR)
+            pixels = region.reshape(-1, 3)
+            chunk_pixels.append(pixels)
+            chunk_sizes.append(pixels.shape[0])
+            total_pixels += pixels.shape[0]
+            end += 1
+
+        # Κάθε (region, channel) παίρνει δικό του offset στο flat bincount
+        region_offsets = np.repeat(
+            np.arange(end - start, dtype=np.int32) * (3 * bins), chunk_sizes
+        )
+        flat_index = bin_lut[np.concatenate(chunk_pixels)]
+        flat_index += channel_offsets
+        flat_index += region_offsets[:, None]
+
+        counts = np.bincount(flat_index.ravel(), minlength=(end - start) * 3 * bins)
+        histograms[start:end] = counts.reshape(end - start, 3, bins)
+        start = end
+
+    # Normalize (ώστε το άθροισμα κάθε καναλιού να είναι 1)
+    histograms /= histograms.sum(axis=2, keepdims=True) + 1e-7
+    return histograms
+
+
+def histogram_to_dict(histogram):
+    """
+    Μετατρέπει ένα (3, bins) histogram array σε dict για το JSON response.
 
-    # Normalize (ώστε το άθροισμα να είναι 1)
-    hist_r = hist_r.flatten() / (hist_r.sum() + 1e-7)
-    hist_g = hist_g.flatten() / (hist_g.sum() + 1e-7)
-    hist_b = hist_b.flatten() / (hist_b.sum() + 1e-7)
+    Args:
+        histogram: numpy array με shape (3, bins) σε RGB σειρά
 
-    # Επιστρέφουμε σε RGB σειρά για ευκολία
+    Returns:
+        dict με histograms για R, G, B κανάλια
+    """
     return {
-        'r': hist_r.tolist(),
-        'g': hist_g.tolist(),
-        'b': hist_b.tolist()
+        'r': histogram[0].tolist(),
+        'g': histogram[1].tolist(),
+        'b': histogram[2].tolist()
     }
 
 
-def extract_tile_with_rotation(image, source_index, rotation, grid_size):
+def histogram_from_dict(histogram):
+    """
+    Αντίστροφο του histogram_to_dict: dict με 'r', 'g', 'b' -> float32 (3, bins) array.
+    """
+    return np.array([histogram['r'], histogram['g'], histogram['b']], dtype=np.float32)
+
+
+def calculate_tile_histograms(image, source_indices, grid_size, border_width, bins=256):
     """
-    Εξάγει ένα tile από την εικόνα και το περιστρέφει.
+    Υπολογίζει τα histograms όλων των tiles και border strips με ένα batch.
+
+    Η περιστροφή δεν αλλάζει το histogram μιας περιοχής, οπότε αρκεί να
+    υπολογιστούν τα 5 regions (tile + 4 borders) στις 0° και τα υπόλοιπα
+    rotations προκύπτουν με αναδιάταξη των borders (ROTATED_BORDER_SOURCE).
 
     Args:
-        image: numpy array της εικόνας
-        source_index: index του tile στην αρχική εικόνα
-        rotation: γωνία περιστροφής σε μοίρες (0, 90, 180, 270)
+        image: numpy array της εικόνας (BGR)
+        source_indices: list με τα sourceIndex των tiles
+        grid_size: μέγεθος grid
+        border_width: πλάτος border σε pixels
+        bins: αριθμός bins
+
+    Returns:
+        tuple (tile_histograms, border_histograms):
+            tile_histograms: float32 array (tiles, 3, bins)
+            border_histograms: float32 array (tiles, rotations, borders, 3, bins)
+    """
+    tiles_view = tile_grid_view(image, grid_size)
+
+    regions = []
+    for source_index in source_indices:
+        tile = tiles_view[source_index // grid_size, source_index % grid_size]
+        regions.append(tile)
+        borders = extract_border_strips(tile, border_width)
+        regions.extend(borders[name] for name in BORDER_NAMES)
+
+    histograms = calculate_color_histograms_batch(regions, bins=bins)
+    histograms = histograms.reshape(len(source_indices), 1 + len(BORDER_NAMES), 3, bins)
+
+    # Αναδιάταξη των borders για κάθε rotation
+    rotation_order = np.array([
+        [1 + BORDER_NAMES.index(ROTATED_BORDER_SOURCE[angle][name]) for name in BORDER_NAMES]
+        for angle in ROTATION_ANGLES
+    ])
+    border_histograms = histograms[:, rotation_order]
+
+    return histograms[:, 0], border_histograms
+
+
+# Διαθέσιμοι συντελεστές σμίκρυνσης κατά το decode (JPEG DCT scaling)
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+# Το PIL χρησιμοποιείται μόνο για το header (read_image_size). Το decompression
+# bomb check θα απέρριπτε ακριβώς τα μεγάλα scans (> ~179 MP) που χρειάζονται
+# reduced decode - το πραγματικό κόστος το ελέγχουν το admission control και το cv2
+Image.MAX_IMAGE_PIXELS = None
+
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def read_image_size(contents):
+    """
+    Διαβάζει μόνο το header της εικόνας για να πάρει τις διαστάσεις της,
+    μετά το EXIF orientation (όπως τις δίνει το cv2.imdecode).
+
+    Returns:
+        tuple (width, height) ή None αν το format δεν αναγνωρίζεται
+    """
+    try:
+        with Image.open(BytesIO(contents)) as header:
+            width, height = header.size
+            # Orientation 5-8: η εικόνα εμφανίζεται περιστραμμένη κατά 90°/270°
+            if header.getexif().get(EXIF_ORIENTATION_TAG) in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+    except Exception:
+        return None
+
+
+def decode_image(contents, grid_size, max_tile_size=0):
+    """
+    Decode εικόνας (BGR) με προαιρετική σμίκρυνση ώστε κάθε tile να μην
+    ξεπερνά τα max_tile_size pixels στη μεγαλύτερη διάσταση.
+
+    Για μεγάλες σμικρύνσεις χρησιμοποιούνται τα IMREAD_REDUCED_* flags, έτσι
+    η εικόνα δεν αποσυμπιέζεται ποτέ ολόκληρη σε πλήρη ανάλυση (για JPEG).
+
+    Args:
+        contents: bytes του αρχείου εικόνας
+        grid_size: μέγεθος grid
+        max_tile_size: μέγιστο μέγεθος tile σε pixels (0 = πλήρης ανάλυση)
+
+    Returns:
+        tuple (image, (scale_x, scale_y)): BGR numpy array και οι συντελεστές
+        σμίκρυνσης ανά άξονα (decoded / original, 1.0 = πλήρης ανάλυση)
+    """
+    nparr = np.frombuffer(contents, np.uint8)
+
+    size = read_image_size(contents) if max_tile_size > 0 else None
+    if size is None:
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR), (1.0, 1.0)
+
+    width, height = size
+    factor = max(width, height) / grid_size / max_tile_size
+    if factor <= 1.0:
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR), (1.0, 1.0)
+
+    # Μεγαλύτερο reduced decode που δεν πέφτει κάτω από το target
+    reduction = max([r for r in REDUCED_DECODE_FLAGS if r <= factor], default=1)
+    if reduction > 1:
+        img = cv2.imdecode(nparr, REDUCED_DECODE_FLAGS[reduction])
+    else:
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+    # Υπόλοιπη σμίκρυνση με INTER_AREA
+    target_width = max(grid_size, int(round(width / factor)))
+    target_height = max(grid_size, int(round(height / factor)))
+    if img.shape[1] > target_width or img.shape[0] > target_height:
+        img = cv2.resize(img, (target_width, target_height), interpolation=cv2.INTER_AREA)
+
+    return img, (img.shape[1] / width, img.shape[0] / height)
+
+
+def tile_grid_view(image, grid_size):
+    """
+    Επιστρέφει την εικόνα ως strided view με shape (grid, grid, th, tw, 3).
+
+    Δεν γίνεται αντιγραφή δεδομένων - tiles[row, col] είναι view πάνω στην
+    αρχική εικόνα. Τα pixels που περισσεύουν (height % grid, width % grid)
+    αγνοούνται, όπως και πριν.
+
+    Args:
+        image: numpy array της εικόνας (height, width, 3)
         grid_size: μέγεθος grid (π.χ. 4 για 4x4)
 
     Returns:
-        numpy array του rotated tile
+        numpy view (grid, grid, tile_height, tile_width, channels)
     """
     height, width = image.shape[:2]
     tile_height = height // grid_size
     tile_width = width // grid_size
+    channels = image.shape[2:] if image.ndim == 3 else ()
+
+    cropped = image[:tile_height * grid_size, :tile_width * grid_size]
+    tiles = cropped.reshape((grid_size, tile_height, grid_size, tile_width) + channels)
+    return tiles.swapaxes(1, 2)
 
-    # Υπολογισμός source position
-    source_row = source_index // grid_size
-    source_col = source_index % grid_size
 
-    # Εξαγωγή tile
-    y1 = source_row * tile_height
-    y2 = y1 + tile_height
-    x1 = source_col * tile_width
-    x2 = x1 + tile_width
+def rotate_tile_view(tile, rotation):
+    """
+    Clockwise περιστροφή tile ως view (χωρίς αντιγραφή, αρνητικά strides).
 
-    tile = image[y1:y2, x1:x2].copy()
+    Args:
+        tile: numpy array (height, width, ...)
+        rotation: γωνία περιστροφής σε μοίρες (0, 90, 180, 270)
 
-    # Περιστροφή tile
+    Returns:
+        numpy view του rotated tile (ίδιο αποτέλεσμα με cv2.rotate)
+    """
     if rotation == 90:
-        tile = cv2.rotate(tile, cv2.ROTATE_90_CLOCKWISE)
+        return np.rot90(tile, k=-1)
     elif rotation == 180:
-        tile = cv2.rotate(tile, cv2.ROTATE_180)
+        return tile[::-1, ::-1]
     elif rotation == 270:
-        tile = cv2.rotate(tile, cv2.ROTATE_90_COUNTERCLOCKWISE)
-
+        return np.rot90(tile, k=1)
     return tile
 
 
@@ -160,6 +382,75 @@ def extract_border_strips(tile, border_width):
     }
 
 
+# Για clockwise rotation 90°: από ποιο border (και αν αντιστρέφεται η σειρά
+# των pixels) προκύπτει κάθε νέο border profile, σε σειρά BORDER_NAMES
+PROFILE_ROTATE_90 = [('left', True), ('top', False), ('right', True), ('bottom', False)]
+
+
+def extract_boundary_profiles(tile, length=None):
+    """
+    Εξάγει τις δύο εξωτερικές γραμμές pixels κάθε border (για το pixel metric).
+
+    Κάθε profile έχει σειρά κατά μήκος της ακμής: αριστερά->δεξιά για
+    top/bottom, πάνω->κάτω για left/right. Έτσι το A.right και το B.left
+    (ή A.bottom και B.top) είναι ευθυγραμμισμένα pixel-προς-pixel.
+
+    Args:
+        tile: numpy array του tile (BGR)
+        length: μήκος profile (default: min(height, width) - resample αν
+                το tile δεν είναι τετράγωνο)
+
+    Returns:
+        uint8 array (borders, 2, length, 3) σε σειρά BORDER_NAMES,
+        όπου [:, 0] η εξωτερική γραμμή και [:, 1] η αμέσως εσωτερική
+    """
+    height, width = tile.shape[:2]
+    if length is None:
+        length = min(height, width)
+    inner_row = min(1, height - 1)
+    inner_col = min(1, width - 1)
+
+    lines = {
+        'top': (tile[0, :], tile[inner_row, :]),
+        'right': (tile[:, width - 1], tile[:, width - 1 - inner_col]),
+        'bottom': (tile[height - 1, :], tile[height - 1 - inner_row, :]),
+        'left': (tile[:, 0], tile[:, inner_col])
+    }
+
+    profiles = np.empty((len(BORDER_NAMES), 2, length, 3), dtype=np.uint8)
+    for border_index, border_name in enumerate(BORDER_NAMES):
+        for line_index, line in enumerate(lines[border_name]):
+            if line.shape[0] != length:
+                line = cv2.resize(
+                    np.ascontiguousarray(line[None]), (length, 1), interpolation=cv2.INTER_AREA
+                )[0]
+            profiles[border_index, line_index] = line
+
+    return profiles
+
+
+def rotate_boundary_profiles(profiles, rotation):
+    """
+    Υπολογίζει τα boundary profiles ενός tile μετά από clockwise rotation,
+    χωρίς να χρειάζεται ξανά το ίδιο το tile.
+
+    Args:
+        profiles: array (..., borders, 2, length, 3) στις 0°
+        rotation: γωνία περιστροφής σε μοίρες (0, 90, 180, 270)
+
+    Returns:
+        array ίδιου shape με τα profiles του rotated tile
+    """
+    for _ in range(rotation // 90):
+        rotated = []
+        for source_border, reverse in PROFILE_ROTATE_90:
+            profile = profiles[..., BORDER_NAMES.index(source_border), :, :, :]
+            rotated.append(profile[..., ::-1, :] if reverse else profile)
+        profiles = np.stack(rotated, axis=-4)
+
+    return profiles
+
+
 def apply_gabor_filters(image_region, num_orientations=4, num_frequencies=3):
     """
     Εφαρμόζει Gabor filters για texture και edge detection.
@@ -226,16 +517,37 @@ def apply_gabor_filters(image_region, num_orientations=4, num_frequencies=3):
     }
 
 
-def extract_cnn_features(image_region):
+def get_feature_extractor(selected_layers):
+    """
+    Feature extractor (cached) για ένα υποσύνολο των layer_names.
+
+    Args:
+        selected_layers: tuple με ονόματα layers σε σειρά layer_names
+
+    Returns:
+        keras Model με ένα output ανά layer
+    """
+    if selected_layers not in feature_extractors:
+        outputs = [base_model.get_layer(name).output for name in selected_layers]
+        feature_extractors[selected_layers] = Model(inputs=base_model.input, outputs=outputs)
+    return feature_extractors[selected_layers]
+
+
+def extract_cnn_features(image_region, selected_layers=None):
     """
     Εξάγει deep CNN features από το MobileNetV2.
 
     Args:
         image_region: numpy array (BGR format)
+        selected_layers: λίστα με layers (default: όλα τα layer_names)
 
     Returns:
         dict με features από intermediate layers
     """
+    if selected_layers is None:
+        selected_layers = layer_names
+    selected_layers = tuple(name for name in layer_names if name in selected_layers)
+
     # Μετατροπή από BGR σε RGB (για το TensorFlow)
     rgb_image = cv2.cvtColor(image_region, cv2.COLOR_BGR2RGB)
 
@@ -249,11 +561,14 @@ def extract_cnn_features(image_region):
     preprocessed = preprocess_input(img_array)
 
     # Εξαγωγή features από intermediate layers
-    layer_features = feature_extractor.predict(preprocessed, verbose=0)
+    layer_features = get_feature_extractor(selected_layers).predict(preprocessed, verbose=0)
+    if len(selected_layers) == 1:
+        layer_features = [layer_features]
 
     # Υπολογισμός statistics για κάθε layer
     features_summary = []
-    for i, (layer_name, features) in enumerate(zip(layer_names, layer_features)):
+    for layer_name, features in zip(selected_layers, layer_features):
+        i = layer_names.index(layer_name)
         # Global Average Pooling για να πάρουμε ένα feature vector
         gap = np.mean(features, axis=(1, 2))  # Shape: (1, channels)
 
@@ -278,87 +593,284 @@ def extract_cnn_features(image_region):
     }
 
 
+# ============================================================================
+# CNN EMBEDDING COMPRESSION
+# ============================================================================
+
+# Precision των compressed embeddings -> (dtype, δεκαδικά στο JSON)
+EMBEDDING_PRECISIONS = {
+    'float16': (np.float16, 4),
+    'float32': (np.float32, 7)
+}
+
+# Πόσα vectors (γραμμές) χρησιμοποιούνται για τη μέτρηση του accuracy tradeoff
+EMBEDDING_EVALUATION_ROWS = 256
+
+
+def normalize_embeddings(vectors):
+    """Unit-length rows (zero vectors stay zero)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def fit_embedding_basis(unit_vectors, dim):
+    """
+    PCA basis (dim, channels) χωρίς centering: η projection που διατηρεί
+    καλύτερα τα dot products (= cosines) των normalized vectors.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(unit_vectors.T @ unit_vectors)
+    order = np.argsort(eigenvalues)[::-1][:dim]
+    return np.ascontiguousarray(eigenvectors[:, order].T, dtype=np.float32)
+
+
+def embedding_accuracy(unit_vectors, compressed):
+    """
+    Accuracy tradeoff των compressed embeddings απέναντι στα πλήρη, σε ένα
+    δείγμα γραμμών απέναντι σε όλα τα vectors.
+
+    Returns:
+        dict με cosineMeanError, cosineMaxError και nearestNeighbourAgreement
+        (ποσοστό γραμμών με τον ίδιο πιο όμοιο vector)
+    """
+    num_vectors = len(unit_vectors)
+    if num_vectors < 2:
+        return {'cosineMeanError': 0.0, 'cosineMaxError': 0.0, 'nearestNeighbourAgreement': 1.0}
+
+    sample = np.unique(np.linspace(0, num_vectors - 1, min(num_vectors, EMBEDDING_EVALUATION_ROWS)).astype(int))
+    compressed = compressed.astype(np.float32)
+    exact = unit_vectors[sample] @ unit_vectors.T
+    approximate = compressed[sample] @ compressed.T
+    error = np.abs(approximate - exact)
+
+    # Ο εαυτός του κάθε vector δεν μετράει ως nearest neighbour
+    rows = np.arange(len(sample))
+    exact[rows, sample] = -np.inf
+    approximate[rows, sample] = -np.inf
+
+    return {
+        'cosineMeanError': float(np.mean(error)),
+        'cosineMaxError': float(np.max(error)),
+        'nearestNeighbourAgreement': float(np.mean(np.argmax(exact, axis=1) == np.argmax(approximate, axis=1)))
+    }
+
+
+def compress_embeddings(vectors, dim=0, precision='float32', basis=None):
+    """
+    Pre-normalization, προαιρετική PCA projection και reduced precision.
+
+    Τα αποτελέσματα είναι unit vectors, οπότε το cosine similarity είναι
+    ένα σκέτο GEMM πάνω σε dim αντί για channels στήλες.
+
+    Args:
+        vectors: numpy array (N, channels)
+        dim: διάσταση μετά την PCA (0 = χωρίς PCA)
+        precision: 'float16' ή 'float32'
+        basis: ήδη fitted basis (dim, channels), π.χ. ανά dataset (None = fit σε αυτά τα vectors)
+
+    Returns:
+        tuple (compressed (N, dim) array, basis ή None, report)
+    """
+    dtype = EMBEDDING_PRECISIONS[precision][0]
+    unit_vectors = normalize_embeddings(np.asarray(vectors, dtype=np.float32))
+    channels = unit_vectors.shape[1]
+
+    if basis is None and 0 < dim < channels:
+        basis = fit_embedding_basis(unit_vectors, dim)
+
+    projected = unit_vectors @ basis.T if basis is not None else unit_vectors
+    compressed = normalize_embeddings(projected).astype(dtype)
+
+    nonzero = np.any(unit_vectors != 0, axis=1)
+    report = {
+        'channels': channels,
+        'dim': int(compressed.shape[1]),
+        'precision': precision,
+        # Μέρος της "ενέργειας" των unit vectors που κρατάει η projection
+        'retainedEnergy': float(np.mean(np.sum(projected[nonzero] ** 2, axis=1))) if nonzero.any() else 1.0,
+        # Σε σχέση με float64 vectors πλήρους διάστασης
+        'compressionRatio': channels * 8 / (compressed.shape[1] * compressed.itemsize)
+    }
+    report.update(embedding_accuracy(unit_vectors, compressed))
+
+    return compressed, basis, report
+
+
+def compress_tile_cnn_features(results, cnn_layers, dim, precision, bases):
+    """
+    Συμπιέζει (in place) όλα τα tile/border CNN vectors των results, ανά layer.
+
+    Args:
+        results: λίστα με tile results του /api/calculate-histograms
+        cnn_layers: τα layers που υπολογίστηκαν
+        dim, precision: όπως στο compress_embeddings
+        bases: dict layer -> basis για reuse (π.χ. ανά dataset); τα νέα bases προστίθενται
+
+    Returns:
+        dict layer -> report του compress_embeddings
+    """
+    decimals = EMBEDDING_PRECISIONS[precision][1]
+    reports = {}
+
+    for layer_name in cnn_layers:
+        entries = [
+            layer
+            for tile in results
+            for rotation in tile['rotationFeatures'].values()
+            for layers in [rotation['tileCnnFeatures'], *rotation['borderCnnFeatures'].values()]
+            for layer in layers
+            if layer['layer_name'] == layer_name
+        ]
+        if not entries:
+            continue
+
+        vectors = np.array([entry['feature_vector'] for entry in entries], dtype=np.float32)
+        compressed, basis, reports[layer_name] = compress_embeddings(vectors, dim, precision, bases.get(layer_name))
+        if basis is not None:
+            bases[layer_name] = basis
+
+        # Στρογγυλοποίηση στην ακρίβεια του dtype (μικρότερο JSON)
+        for entry, vector in zip(entries, np.round(compressed.astype(np.float64), decimals)):
+            entry['feature_vector'] = vector.tolist()
+            entry['vector_dim'] = len(vector)
+
+    return reports
+
+
 # ============================================================================
 # ADJACENCY MATRIX - DISTANCE METRICS
 # ============================================================================
 
 def chi_square_distance(hist1, hist2):
     """
-    Calculate Chi-Square distance between two color histograms.
+    Calculate Chi-Square distance between color histograms.
+
+    Both inputs are float32 arrays of shape (..., 3, bins) (normalized, RGB order)
+    and broadcast against each other, so one border can be compared against a
+    whole stack of candidate borders in a single call.
 
     Args:
-        hist1: dict with keys 'r', 'g', 'b' (normalized histograms)
-        hist2: dict with keys 'r', 'g', 'b' (normalized histograms)
+        hist1: numpy array (..., 3, bins)
+        hist2: numpy array (..., 3, bins)
 
     Returns:
-        float: Chi-square distance (lower is better, 0 = identical)
+        float or numpy array: Chi-square distance (lower is better, 0 = identical)
     """
-    distance = 0.0
+    # Chi-square formula: sum((h1[i] - h2[i])^2 / (h1[i] + h2[i] + eps))
+    chi_sq = np.sum((hist1 - hist2) ** 2 / (hist1 + hist2 + 1e-10), axis=(-2, -1))
 
-    for channel in ['r', 'g', 'b']:
-        h1 = np.array(hist1[channel])
-        h2 = np.array(hist2[channel])
+    # Average across 3 channels
+    return chi_sq / 3.0
 
-        # Chi-square formula: sum((h1[i] - h2[i])^2 / (h1[i] + h2[i] + eps))
-        chi_sq = np.sum((h1 - h2) ** 2 / (h1 + h2 + 1e-10))
-        distance += chi_sq
 
-    # Average across 3 channels
-    return distance / 3.0
+# Μέγιστος αριθμός στοιχείων στα ενδιάμεσα arrays των pairwise υπολογισμών
+PAIRWISE_CHUNK_ELEMENTS = 1 << 24
 
 
-def cosine_similarity(vec1, vec2):
+def pairwise_chi_square(hists1, hists2):
     """
-    Calculate cosine similarity between two feature vectors.
+    Chi-Square distance between every histogram of hists1 and every histogram of hists2.
 
     Args:
-        vec1: list or numpy array (CNN feature vector)
-        vec2: list or numpy array (CNN feature vector)
+        hists1: numpy array (N, 3, bins)
+        hists2: numpy array (M, 3, bins)
 
     Returns:
-        float: Cosine similarity (0-1, higher is better, 1 = identical direction)
+        numpy array (N, M)
     """
-    v1 = np.array(vec1)
-    v2 = np.array(vec2)
+    distances = np.empty((hists1.shape[0], hists2.shape[0]), dtype=np.float32)
 
-    # Cosine similarity: dot(v1, v2) / (||v1|| * ||v2||)
-    dot_product = np.dot(v1, v2)
-    norm1 = np.linalg.norm(v1)
-    norm2 = np.linalg.norm(v2)
+    # Chunk over rows so the (rows, M, 3, bins) intermediate stays bounded
+    rows = max(1, PAIRWISE_CHUNK_ELEMENTS // max(1, hists2.size))
+    for start in range(0, hists1.shape[0], rows):
+        chunk = hists1[start:start + rows, None]
+        distances[start:start + rows] = chi_square_distance(chunk, hists2[None])
+
+    return distances
+
+
+def cosine_similarity(vectors1, vectors2):
+    """
+    Calculate cosine similarity between every pair of feature vectors (one GEMM).
+
+    Args:
+        vectors1: numpy array (N, D) (CNN feature vectors)
+        vectors2: numpy array (M, D) (CNN feature vectors)
 
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
+    Returns:
+        numpy array (N, M): Cosine similarity (0-1, higher is better, 1 = identical direction)
+    """
+    norms1 = np.linalg.norm(vectors1, axis=1, keepdims=True)
+    norms2 = np.linalg.norm(vectors2, axis=1, keepdims=True)
 
-    similarity = dot_product / (norm1 * norm2)
+    # Zero vectors get similarity 0 (their normalized form stays 0)
+    unit1 = vectors1 / np.where(norms1 == 0, 1.0, norms1)
+    unit2 = vectors2 / np.where(norms2 == 0, 1.0, norms2)
+
+    # Cosine similarity: dot(v1, v2) / (||v1|| * ||v2||)
+    similarity = unit1 @ unit2.T
 
     # Clamp to [0, 1] range (cosine can be negative for opposite directions)
-    return max(0.0, min(1.0, similarity))
+    return np.clip(similarity, 0.0, 1.0)
 
 
-def euclidean_distance(features1, features2):
+def euclidean_distance(vectors1, vectors2):
     """
-    Calculate Euclidean (L2) distance between two Gabor feature sets.
+    Calculate Euclidean (L2) distance between every pair of Gabor feature vectors.
 
     Args:
-        features1: list of dicts with keys 'mean', 'std', 'energy' (12 filters)
-        features2: list of dicts with keys 'mean', 'std', 'energy' (12 filters)
+        vectors1: numpy array (N, 36) - [mean, std, energy] for 12 filters
+        vectors2: numpy array (M, 36)
 
     Returns:
-        float: Euclidean distance (lower is better, 0 = identical)
+        numpy array (N, M): Euclidean distance (lower is better, 0 = identical)
     """
-    # Flatten all features into vectors
-    vec1 = []
-    vec2 = []
+    v1 = vectors1.astype(np.float64)
+    v2 = vectors2.astype(np.float64)
+
+    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+    squared = (
+        np.sum(v1 ** 2, axis=1)[:, None] +
+        np.sum(v2 ** 2, axis=1)[None, :] -
+        2.0 * (v1 @ v2.T)
+    )
 
-    for f1, f2 in zip(features1, features2):
-        vec1.extend([f1['mean'], f1['std'], f1['energy']])
-        vec2.extend([f2['mean'], f2['std'], f2['energy']])
+    # L2 distance
+    return np.sqrt(np.maximum(squared, 0.0))
 
-    v1 = np.array(vec1)
-    v2 = np.array(vec2)
 
-    # L2 distance
-    return np.linalg.norm(v1 - v2)
+def boundary_dissimilarity(profiles1, profiles2):
+    """
+    Pixel-level seam dissimilarity between facing boundaries.
+
+    Each side extrapolates its edge one pixel across the seam using its local
+    gradient (2 * outer - inner) and the prediction is compared with the
+    other side's outer line. The squared errors of both directions are
+    averaged, so a smooth continuation scores low even across strong but
+    consistent gradients. The sums of squares are expanded so the whole
+    (N, M) matrix reduces to two matrix products.
+
+    Args:
+        profiles1: numpy array (N, 2, length, 3) - boundaries of tile A
+        profiles2: numpy array (M, 2, length, 3) - facing boundaries of tile B
+
+    Returns:
+        numpy array (N, M): RMS prediction error in pixel units (lower is better)
+    """
+    p1 = profiles1.reshape(profiles1.shape[0], 2, -1).astype(np.float64)
+    p2 = profiles2.reshape(profiles2.shape[0], 2, -1).astype(np.float64)
+
+    outer1, predicted1 = p1[:, 0], 2.0 * p1[:, 0] - p1[:, 1]
+    outer2, predicted2 = p2[:, 0], 2.0 * p2[:, 0] - p2[:, 1]
+
+    # sum((pred1 - outer2)^2) + sum((pred2 - outer1)^2), expanded
+    squared = (
+        np.sum(predicted1 ** 2, axis=1)[:, None] + np.sum(outer2 ** 2, axis=1)[None, :] -
+        2.0 * (predicted1 @ outer2.T) +
+        np.sum(outer1 ** 2, axis=1)[:, None] + np.sum(predicted2 ** 2, axis=1)[None, :] -
+        2.0 * (outer1 @ predicted2.T)
+    )
+
+    return np.sqrt(np.maximum(squared, 0.0) / (2 * p1.shape[2]))
 
 
 def normalize_to_similarity(distance, max_distance):
@@ -367,25 +879,48 @@ def normalize_to_similarity(distance, max_distance):
     Lower distance = higher similarity.
 
     Args:
-        distance: Raw distance value
+        distance: Raw distance value (float or numpy array)
         max_distance: Maximum possible distance (for normalization)
 
     Returns:
-        float: Similarity score (0-1, higher is better, 1 = identical)
+        float or numpy array: Similarity score (0-1, higher is better, 1 = identical)
     """
     # Avoid division by zero
     if max_distance == 0:
-        return 1.0
+        return np.ones_like(distance)
 
     # Convert distance to similarity: similarity = 1 - (distance / max_distance)
-    similarity = 1.0 - min(distance / max_distance, 1.0)
-    return max(0.0, similarity)
+    return np.clip(1.0 - np.asarray(distance) / max_distance, 0.0, 1.0)
 
 
 # ============================================================================
 # ADJACENCY MATRIX - BORDER MATCHING LOGIC
 # ============================================================================
 
+def stack_border_histograms(tiles):
+    """
+    Convert the border histograms of a /api/calculate-histograms payload into
+    a single float32 array, once per request.
+
+    Args:
+        tiles: list of tile results (with 'rotationFeatures')
+
+    Returns:
+        numpy array (tiles, rotations, borders, 3, bins) indexed with
+        ROTATION_ANGLES / BORDER_NAMES order
+    """
+    return np.stack([
+        np.stack([
+            np.stack([
+                histogram_from_dict(tile['rotationFeatures'][str(angle)]['borderHistograms'][border])
+                for border in BORDER_NAMES
+            ])
+            for angle in ROTATION_ANGLES
+        ])
+        for tile in tiles
+    ])
+
+
 def get_opposite_border(border, rotation):
     """
     Get which border of tileB should match with border of tileA,
@@ -439,220 +974,1358 @@ def get_opposite_border(border, rotation):
     return rotation_map[rotation][border]
 
 
-def get_border_compatibility(borderA_features, borderB_features, weights, cnn_layer_name):
+def stack_border_gabor(tiles):
     """
-    Calculate compatibility between two borders using multiple metrics.
+    Stack the border Gabor features of a payload into one array.
 
     Args:
-        borderA_features: dict with 'histogram', 'gabor', 'cnn' keys
-        borderB_features: dict with 'histogram', 'gabor', 'cnn' keys
-        weights: dict with metric weights {'color': float, 'gabor': float, 'cnn': float}
-        cnn_layer_name: which CNN layer to use for comparison (e.g., 'block_6_expand_relu')
+        tiles: list of tile results (with 'rotationFeatures')
 
     Returns:
-        dict: {
-            'combined': float (weighted average, 0-1, higher = better match),
-            'color': float (0-1, higher = better),
-            'gabor': float (0-1, higher = better),
-            'cnn': float (0-1, higher = better)
-        }
+        numpy array (tiles, rotations, borders, 36) with [mean, std, energy]
+        per filter, or None if the features were not extracted
     """
-    scores = {}
-
-    # 1. Color Histogram - Chi-Square Distance
-    color_dist = chi_square_distance(
-        borderA_features['histogram'],
-        borderB_features['histogram']
+    vectors = []
+    for tile in tiles:
+        for angle in ROTATION_ANGLES:
+            border_features = tile['rotationFeatures'][str(angle)]['borderGaborFeatures']
+            for border in BORDER_NAMES:
+                features = border_features.get(border)
+                if not features:
+                    return None
+                vectors.append([value for f in features for value in (f['mean'], f['std'], f['energy'])])
+
+    return np.array(vectors, dtype=np.float64).reshape(
+        len(tiles), len(ROTATION_ANGLES), len(BORDER_NAMES), -1
     )
-    # Normalize chi-square distance (typical max ~2.0 for normalized histograms)
-    scores['color'] = normalize_to_similarity(color_dist, max_distance=2.0)
 
-    # 2. Gabor Features - Euclidean Distance
-    gabor_dist = euclidean_distance(
-        borderA_features['gabor'],
-        borderB_features['gabor']
-    )
-    # Normalize (empirical max based on typical Gabor feature ranges)
-    # 12 filters * 3 features = 36 values, typical range ~0-100 each
-    scores['gabor'] = normalize_to_similarity(gabor_dist, max_distance=200.0)
-
-    # 3. CNN Features - Cosine Similarity
-    # Find the specified layer
-    cnn_vectorA = None
-    cnn_vectorB = None
-
-    for layer in borderA_features['cnn']:
-        if layer['layer_name'] == cnn_layer_name:
-            cnn_vectorA = layer['feature_vector']
-            break
-
-    for layer in borderB_features['cnn']:
-        if layer['layer_name'] == cnn_layer_name:
-            cnn_vectorB = layer['feature_vector']
-            break
-
-    if cnn_vectorA and cnn_vectorB:
-        scores['cnn'] = cosine_similarity(cnn_vectorA, cnn_vectorB)
-    else:
-        scores['cnn'] = 0.0
 
-    # 4. Combined weighted score
-    scores['combined'] = (
-        weights['color'] * scores['color'] +
-        weights['gabor'] * scores['gabor'] +
-        weights['cnn'] * scores['cnn']
-    )
+def stack_border_cnn(tiles, cnn_layer_name):
+    """
+    Stack the border CNN vectors of one layer into one array.
 
-    return scores
+    Borders without a vector for the layer get a zero vector, which scores
+    a cosine similarity of 0 against everything.
 
+    Args:
+        tiles: list of tile results (with 'rotationFeatures')
+        cnn_layer_name: which CNN layer to use (e.g., 'block_6_expand_relu')
 
-@app.post("/api/calculate-histograms")
-async def calculate_histograms(
-    image: UploadFile = File(...),
-    gridSize: int = Form(...),
-    borderWidth: int = Form(...),
-    bins: int = Form(256),  # Αριθμός bins για histograms (default: 256)
-    tiles: str = Form(...)  # JSON string με tile metadata
-):
-    """
-    Endpoint που:
-    1. Δέχεται εικόνα + metadata
-    2. Για κάθε tile, υπολογίζει features για ΟΛΕΣ τις πιθανές rotations (0°, 90°, 180°, 270°)
-    3. Εξάγει border strips για κάθε rotation
-    4. Αποθηκεύει τα border strips ως εικόνες στο tempPhotos
-    5. Υπολογίζει color histograms, Gabor features και CNN features για κάθε border
+    Returns:
+        numpy float32 array (tiles, rotations, borders, channels), or None
+        if no border has the layer
     """
-    # Διάβασμα εικόνας
-    contents = await image.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    # Η εικόνα είναι σε BGR format (cv2.imdecode επιστρέφει BGR)
-    # ΔΕΝ μετατρέπουμε σε RGB γιατί όλες οι συναρτήσεις μας δουλεύουν με BGR
+    vectors = {}
+    num_channels = 0
+    for i, tile in enumerate(tiles):
+        for rotation_index, angle in enumerate(ROTATION_ANGLES):
+            border_features = tile['rotationFeatures'][str(angle)]['borderCnnFeatures']
+            for border_index, border in enumerate(BORDER_NAMES):
+                for layer in border_features.get(border, []):
+                    if layer['layer_name'] == cnn_layer_name and layer['feature_vector']:
+                        vectors[(i, rotation_index, border_index)] = layer['feature_vector']
+                        num_channels = len(layer['feature_vector'])
+                        break
 
-    # Parse tile metadata
-    tiles_data = json.loads(tiles)
+    if not vectors:
+        return None
 
-    # Δημιουργία φακέλου tempPhotos στο root
-    # Το backend τρέχει από τον φάκελο backend, οπότε πάμε ένα επίπεδο πάνω
-    base_path = Path(__file__).parent.parent  # Πάει από backend/ στο root
-    temp_photos_dir = base_path / "tempPhotos"
+    stacked = np.zeros((len(tiles), len(ROTATION_ANGLES), len(BORDER_NAMES), num_channels), dtype=np.float32)
+    for key, vector in vectors.items():
+        stacked[key] = vector
 
-    # Διαγραφή παλιού φακέλου αν υπάρχει και δημιουργία νέου
-    if temp_photos_dir.exists():
-        shutil.rmtree(temp_photos_dir)
-    temp_photos_dir.mkdir(exist_ok=True)
+    return stacked
 
-    saved_images = []
-    results = []
 
-    # Δημιουργία υποφακέλου για Gabor filtered images
-    gabor_dir = temp_photos_dir / "gabor_filters"
-    gabor_dir.mkdir(exist_ok=True)
+def stack_boundary_profiles(tiles):
+    """
+    Stack the boundary pixel profiles of a payload for every rotation.
 
-    # Για κάθε tile (sourceIndex), υπολογίζουμε features για όλες τις rotations
-    for idx, tile_meta in enumerate(tiles_data):
-        source_index = tile_meta['sourceIndex']
-        dest_position = tile_meta['destPosition']
-        shuffle_rotation = tile_meta['rotation']  # Η rotation από το shuffle (για reference)
+    Only the 0° profiles are sent by /api/calculate-histograms; the other
+    rotations are derived with rotate_boundary_profiles.
 
-        # Dictionary για να αποθηκεύσουμε features για κάθε rotation
-        rotation_features = {}
+    Args:
+        tiles: list of tile results (with 'boundaryPixels')
 
-        # Υπολογισμός features για όλες τις πιθανές rotations
-        for rotation_angle in [0, 90, 180, 270]:
-            # Εξαγωγή tile με αυτή τη rotation
-            tile = extract_tile_with_rotation(img, source_index, rotation_angle, gridSize)
+    Returns:
+        numpy float32 array (tiles, rotations, borders, 2, length, 3), or
+        None if the payload has no boundary pixels
+    """
+    if not tiles or any('boundaryPixels' not in tile for tile in tiles):
+        return None
 
-            # Υπολογισμός histogram για ολόκληρο το tile
-            tile_histogram = calculate_color_histogram(tile, bins=bins)
+    profiles = np.array([
+        [tile['boundaryPixels'][border] for border in BORDER_NAMES]
+        for tile in tiles
+    ], dtype=np.float32)
 
-            # Εφαρμογή Gabor filters στο tile
-            tile_gabor = apply_gabor_filters(tile, num_orientations=4, num_frequencies=3)
+    return np.stack(
+        [rotate_boundary_profiles(profiles, angle) for angle in ROTATION_ANGLES], axis=1
+    )
 
-            # Εξαγωγή CNN features από το tile
-            tile_cnn = extract_cnn_features(tile)
 
-            # Αποθήκευση Gabor filtered images για το tile
-            for filter_idx, gabor_response in enumerate(tile_gabor['responses']):
-                # Normalize στο [0, 255] για αποθήκευση
-                gabor_normalized = cv2.normalize(gabor_response, None, 0, 255, cv2.NORM_MINMAX)
-                gabor_uint8 = gabor_normalized.astype(np.uint8)
+# Metrics that can be selected through `weights`
+METRIC_NAMES = ['color', 'gabor', 'cnn', 'pixel']
 
-                # Αποθήκευση
-                gabor_filename = f"tile_{idx}_rot{rotation_angle}_gabor_{filter_idx}.jpg"
-                gabor_filepath = gabor_dir / gabor_filename
-                cv2.imwrite(str(gabor_filepath), gabor_uint8)
+# Opposite borders (για rotation=0 case - τα borders που πρέπει να ταιριάζουν)
+OPPOSITE_BORDERS = {
+    'top': 'bottom',
+    'right': 'left',
+    'bottom': 'top',
+    'left': 'right'
+}
 
-            # Εξαγωγή border strips
-            borders = extract_border_strips(tile, borderWidth)
 
-            # Υπολογισμός histogram, Gabor και CNN features για κάθε border
-            border_histograms = {}
-            border_gabor_features = {}
-            border_cnn_features = {}
+def pairwise_metric_similarity(metric, featuresA, featuresB):
+    """
+    Similarity (0-1, higher = better) of every A border against every B border for one metric.
 
-            # Αποθήκευση κάθε border strip ως εικόνα
-            for border_name, border_img in borders.items():
-                # Υπολογισμός histogram για το border
-                border_histograms[border_name] = calculate_color_histogram(border_img, bins=bins)
+    Args:
+        metric: one of METRIC_NAMES
+        featuresA: numpy array (N, ...) - stacked features of the A borders
+        featuresB: numpy array (M, ...) - stacked features of the facing B borders
 
-                # Εφαρμογή Gabor filters στο border
-                border_gabor = apply_gabor_filters(border_img, num_orientations=4, num_frequencies=3)
-                border_gabor_features[border_name] = border_gabor['features']
+    Returns:
+        numpy float32 array (N, M)
+    """
+    if metric == 'color':
+        # Chi-square distance (typical max ~2.0 for normalized histograms)
+        return normalize_to_similarity(pairwise_chi_square(featuresA, featuresB), max_distance=2.0)
 
-                # Εξαγωγή CNN features από το border
-                border_cnn = extract_cnn_features(border_img)
-                border_cnn_features[border_name] = border_cnn['layers']
+    if metric == 'gabor':
+        # Euclidean distance (empirical max based on typical Gabor feature ranges)
+        # 12 filters * 3 features = 36 values, typical range ~0-100 each
+        return normalize_to_similarity(euclidean_distance(featuresA, featuresB), max_distance=200.0)
 
-                # Αποθήκευση Gabor filtered images για το border
-                for filter_idx, gabor_response in enumerate(border_gabor['responses']):
-                    # Normalize στο [0, 255]
-                    gabor_normalized = cv2.normalize(gabor_response, None, 0, 255, cv2.NORM_MINMAX)
-                    gabor_uint8 = gabor_normalized.astype(np.uint8)
+    if metric == 'cnn':
+        # float16 embeddings: storage format only, the GEMM runs in float32
+        return cosine_similarity(
+            np.asarray(featuresA, dtype=np.float32), np.asarray(featuresB, dtype=np.float32)
+        )
 
-                    # Αποθήκευση
-                    gabor_filename = f"tile_{idx}_rot{rotation_angle}_{border_name}_gabor_{filter_idx}.jpg"
-                    gabor_filepath = gabor_dir / gabor_filename
-                    cv2.imwrite(str(gabor_filepath), gabor_uint8)
+    if metric == 'pixel':
+        # RMS seam prediction error in pixel units (empirical max)
+        return normalize_to_similarity(boundary_dissimilarity(featuresA, featuresB), max_distance=128.0)
 
-                # Όνομα αρχείου: tile_0_rot90_top.jpg, κλπ.
-                filename = f"tile_{idx}_src{source_index}_rot{rotation_angle}_{border_name}.jpg"
-                filepath = temp_photos_dir / filename
+    raise ValueError(f"Unknown metric: {metric}")
 
-                # Αποθήκευση εικόνας (ήδη σε BGR format)
-                cv2.imwrite(str(filepath), border_img)
 
-                saved_images.append(filename)
+def compute_compatibility_scores(features, weights, num_tiles):
+    """
+    Calculate compatibility between all border pairs using multiple metrics, vectorized
+    across every (tile, rotation) pair.
 
-            # Αποθήκευση features για αυτή τη rotation
-            # Use string keys for JSON compatibility
-            rotation_features[str(rotation_angle)] = {
-                'tileHistogram': tile_histogram,
-                'borderHistograms': border_histograms,
-                'tileGaborFeatures': tile_gabor['features'],
+    Metrics with a zero weight (or without features in the payload) are not
+    computed at all and score 0, so e.g. {'pixel': 1.0} runs without any
+    histogram, Gabor or CNN comparisons.
+
+    Args:
+        features: dict metric -> stacked array (tiles, rotations, borders, ...) or None
+        weights: dict with metric weights {'color': float, 'gabor': float, 'cnn': float, 'pixel': float}
+        num_tiles: number of tiles
+
+    Returns:
+        dict: metric name and 'combined' -> float32 array (tileA, rotationA, borderA, tileB, rotationB)
+              with scores in 0-1 (higher = better match); borderB is OPPOSITE_BORDERS[borderA].
+              Metrics that were not computed map to None.
+    """
+    num_rotations = len(ROTATION_ANGLES)
+    shape = (num_tiles, num_rotations, len(BORDER_NAMES), num_tiles, num_rotations)
+
+    scores = {metric: None for metric in METRIC_NAMES}
+    scores['combined'] = np.zeros(shape, dtype=np.float32)
+
+    for metric in METRIC_NAMES:
+        weight = weights.get(metric, 0.0)
+        stacked = features.get(metric)
+        if weight <= 0 or stacked is None:
+            continue
+
+        scores[metric] = np.zeros(shape, dtype=np.float32)
+        flat = stacked.reshape((num_tiles * num_rotations, len(BORDER_NAMES)) + stacked.shape[3:])
+        for borderA_index, borderA in enumerate(BORDER_NAMES):
+            borderB_index = BORDER_NAMES.index(OPPOSITE_BORDERS[borderA])
+            similarity = pairwise_metric_similarity(metric, flat[:, borderA_index], flat[:, borderB_index])
+            scores[metric][:, :, borderA_index] = similarity.reshape(
+                num_tiles, num_rotations, num_tiles, num_rotations
+            )
+
+        # Combined weighted score
+        scores['combined'] += weight * scores[metric]
+
+    return scores
+
+
+def build_match_entry(scores, flat_index):
+    """
+    Build the JSON entry of one border pair from the score arrays.
+
+    Args:
+        scores: dict returned by compute_compatibility_scores
+        flat_index: index into the flattened (tileA, rotationA, borderA, tileB, rotationB) array
+
+    Returns:
+        dict with tile/rotation/border of both sides, combined and per-metric scores
+    """
+    tileA, rotA, borderA, tileB, rotB = np.unravel_index(flat_index, scores['combined'].shape)
+    borderA_name = BORDER_NAMES[borderA]
+
+    return {
+        'tileA': int(tileA),
+        'rotationA': ROTATION_ANGLES[rotA],
+        'borderA': borderA_name,
+        'tileB': int(tileB),
+        'rotationB': ROTATION_ANGLES[rotB],
+        'borderB': OPPOSITE_BORDERS[borderA_name],
+        'compatibilityScore': float(scores['combined'][tileA, rotA, borderA, tileB, rotB]),
+        'scores': {
+            metric: float(scores[metric][tileA, rotA, borderA, tileB, rotB]) if scores[metric] is not None else 0.0
+            for metric in METRIC_NAMES
+        }
+    }
+
+
+# ============================================================================
+# SHARED FEATURE / SCORE STORE (across uvicorn workers)
+# ============================================================================
+
+# Φάκελος του store - στο /dev/shm (RAM) όπου υπάρχει
+SHARED_STORE_DIR = Path(os.environ.get(
+    'SHARED_STORE_DIR',
+    '/dev/shm/analyshEikonas-store' if os.path.isdir('/dev/shm')
+    else os.path.join(tempfile.gettempdir(), 'analyshEikonas-store')
+))
+SHARED_STORE_MAX_MB = float(os.environ.get('SHARED_STORE_MAX_MB', 2048))
+SHARED_STORE_MAX_ENTRIES = int(os.environ.get('SHARED_STORE_MAX_ENTRIES', 32))
+
+# Αρχεία χωρίς entry στο index (worker που έπεσε πριν το καταχωρήσει) διαγράφονται μετά από τόσα seconds
+ORPHAN_FILE_AGE = 300
+
+
+def process_alive(pid):
+    """True αν το process υπάρχει (για references από workers που έπεσαν)."""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedTensorStore:
+    """
+    Named groups of numpy tensors shared by all worker processes.
+
+    Every tensor is an .npy file in SHARED_STORE_DIR (tmpfs under /dev/shm)
+    and is attached with np.load(mmap_mode='r'), so all workers map the same
+    pages - nothing is copied or recomputed. A JSON index next to the files,
+    guarded by an flock, holds per entry its files, metadata, size, last
+    access and references per pid. Entries are evicted least recently used
+    first when the store exceeds its size/entry budget, but never while a
+    live process holds a reference (retain/release); an explicit delete of a
+    referenced entry is deferred to its last release. Pinned entries (e.g.
+    dataset-wide CNN bases) are never evicted, only deleted explicitly.
+    """
+
+    def __init__(self, directory, max_bytes, max_entries):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / 'index.json'
+        self.lock_path = self.directory / 'index.lock'
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.pid = str(os.getpid())
+        # key -> (tensors, meta) που έχει κάνει attach αυτό το process
+        self.attached = {}
+        self.thread_lock = threading.Lock()
+
+        with self.locked_index() as index:
+            self.remove_orphan_files(index)
+
+    @contextmanager
+    def locked_index(self):
+        """Exclusive access to the index (threads and processes); saved on exit."""
+        with self.thread_lock, open(self.lock_path, 'a+') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.index_path) as index_file:
+                    index = json.load(index_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                index = {}
+
+            yield index
+
+            # Καθαρισμός attachments σε entries που διαγράφηκαν από άλλο worker
+            for key in [key for key in self.attached if key not in index or index[key]['deleted']]:
+                del self.attached[key]
+
+            temp_path = self.index_path.with_suffix(f'.{self.pid}.tmp')
+            with open(temp_path, 'w') as index_file:
+                json.dump(index, index_file)
+            os.replace(temp_path, self.index_path)
+
+    def put(self, kind, tensors, meta, pinned=False):
+        """
+        Store a group of tensors and return its key, or None if the group alone
+        is larger than the store's size budget (nothing is stored then).
+        A pinned group is exempt from eviction.
+        """
+        arrays = {name: np.ascontiguousarray(tensor) for name, tensor in tensors.items()}
+        total_bytes = sum(array.nbytes for array in arrays.values())
+        if total_bytes > self.max_bytes:
+            print(f"Shared store: {kind} entry of {total_bytes / 2 ** 20:.1f} MB exceeds the {self.max_bytes / 2 ** 20:.0f} MB budget, not stored")
+            return None
+
+        key = uuid.uuid4().hex
+        files = {}
+        for name, array in arrays.items():
+            files[name] = f'{key}.{name}.npy'
+            np.save(self.directory / files[name], array)
+
+        with self.locked_index() as index:
+            index[key] = {
+                'kind': kind,
+                'files': files,
+                'meta': meta,
+                'bytes': total_bytes,
+                'lastAccess': time.time(),
+                'refs': {},
+                'pinned': pinned,
+                'deleted': False
+            }
+            # Το νέο entry δεν γίνεται evict από το ίδιο του το put
+            self.evict(index, keep=key)
+
+        return key
+
+    def get(self, key, kind):
+        """(tensors, meta) of a stored entry, memory-mapped, or None."""
+        with self.locked_index() as index:
+            entry = index.get(key)
+            if entry is None or entry['deleted'] or entry['kind'] != kind:
+                return None
+            entry['lastAccess'] = time.time()
+
+            if key not in self.attached:
+                # Φόρτωση μέσα στο lock ώστε τα αρχεία να μην διαγραφούν στο μεταξύ
+                tensors = {
+                    name: np.load(self.directory / filename, mmap_mode='r')
+                    for name, filename in entry['files'].items()
+                }
+                self.attached[key] = (tensors, entry['meta'])
+
+        return self.attached[key]
+
+    def retain(self, key):
+        """Protect an entry from eviction until release (e.g. while a solver uses it)."""
+        with self.locked_index() as index:
+            entry = index.get(key)
+            if entry is None or entry['deleted']:
+                return False
+            entry['refs'][self.pid] = entry['refs'].get(self.pid, 0) + 1
+        return True
+
+    def release(self, key):
+        with self.locked_index() as index:
+            entry = index.get(key)
+            if entry is None:
+                return
+            count = entry['refs'].get(self.pid, 0) - 1
+            if count > 0:
+                entry['refs'][self.pid] = count
+            else:
+                entry['refs'].pop(self.pid, None)
+            if entry['deleted'] and not self.live_refs(entry):
+                self.remove(index, key)
+
+    def delete(self, key, kind):
+        """Delete an entry now, or at its last release if it is referenced."""
+        with self.locked_index() as index:
+            entry = index.get(key)
+            if entry is None or entry['deleted'] or entry['kind'] != kind:
+                return False
+            if self.live_refs(entry):
+                entry['deleted'] = True
+            else:
+                self.remove(index, key)
+        return True
+
+    def live_refs(self, entry):
+        """Reference count without the references of processes that no longer exist."""
+        entry['refs'] = {pid: count for pid, count in entry['refs'].items() if process_alive(int(pid))}
+        return sum(entry['refs'].values())
+
+    def remove(self, index, key):
+        # Τα mappings που υπάρχουν ήδη μένουν έγκυρα (POSIX) μέχρι να κλείσουν
+        for filename in index.pop(key)['files'].values():
+            try:
+                os.remove(self.directory / filename)
+            except OSError:
+                pass
+
+    def evict(self, index, keep=None):
+        """
+        Least recently used unreferenced, unpinned entries (except keep) out until
+        the store fits its budget. Pinned entries do not count towards max_entries.
+        """
+        for key in sorted(index, key=lambda key: index[key]['lastAccess']):
+            total_bytes = sum(entry['bytes'] for entry in index.values())
+            evictable_entries = sum(1 for entry in index.values() if not entry.get('pinned'))
+            if total_bytes <= self.max_bytes and evictable_entries <= self.max_entries:
+                break
+            if key != keep and not index[key].get('pinned') and not self.live_refs(index[key]):
+                self.remove(index, key)
+
+    def remove_orphan_files(self, index):
+        known = {filename for entry in index.values() for filename in entry['files'].values()}
+        for path in self.directory.glob('*.npy'):
+            try:
+                if path.name not in known and time.time() - path.stat().st_mtime > ORPHAN_FILE_AGE:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def statistics(self):
+        with self.locked_index() as index:
+            return {
+                'entries': len(index),
+                'bytes': sum(entry['bytes'] for entry in index.values()),
+                'maxBytes': self.max_bytes,
+                'maxEntries': self.max_entries,
+                'referenced': sum(1 for entry in index.values() if self.live_refs(entry)),
+                'pinned': sum(1 for entry in index.values() if entry.get('pinned')),
+                'attachedInThisWorker': len(self.attached)
+            }
+
+
+shared_store = SharedTensorStore(
+    SHARED_STORE_DIR,
+    max_bytes=SHARED_STORE_MAX_MB * 2 ** 20,
+    max_entries=SHARED_STORE_MAX_ENTRIES
+)
+
+
+def stack_tile_features(tiles, cnn_layers, cnn_dtype=np.float32):
+    """
+    Stacked feature tensors of a /api/calculate-histograms payload, keyed as
+    in the shared store: 'color', 'gabor', 'pixel' and 'cnn.<layer>' (stored
+    as cnn_dtype). Features that were not extracted are left out.
+    """
+    tensors = {
+        'color': stack_border_histograms(tiles),
+        'gabor': stack_border_gabor(tiles),
+        'pixel': stack_boundary_profiles(tiles)
+    }
+    for layer in cnn_layers:
+        vectors = stack_border_cnn(tiles, layer)
+        tensors[f'cnn.{layer}'] = vectors.astype(cnn_dtype) if vectors is not None else None
+    return {name: tensor for name, tensor in tensors.items() if tensor is not None}
+
+
+# ============================================================================
+# ADJACENCY MATRIX - SERVER-SIDE RESULTS
+# ============================================================================
+
+class AdjacencyResult:
+    """
+    A computed adjacency matrix kept server-side and indexed for queries.
+
+    Scores stay in the compact float32 (tileA, rotationA, borderA, tileB, rotationB)
+    arrays of compute_compatibility_scores. Two indexes are built once:
+    - row_order: for every (tileA, rotationA, borderA) its (tileB, rotationB)
+      candidates sorted by score, so the best K partners are an O(K) slice
+    - ranking / ranking_scores: every valid pair sorted by score, so pages of
+      the global ranking and score thresholds are O(page) / O(log n)
+
+    Results live in the shared store (to_tensors / from_tensors), so any
+    worker can answer queries on a matrix computed by another.
+    """
+
+    def __init__(self, scores, grid_size, weights, cnn_layer, indexes=None):
+        self.scores = scores
+        self.grid_size = grid_size
+        self.weights = weights
+        self.cnn_layer = cnn_layer
+
+        shape = scores['combined'].shape
+        self.num_tiles = shape[0]
+        self.num_columns = shape[3] * shape[4]
+
+        if indexes is not None:
+            self.row_order, self.ranking, self.ranking_scores = indexes
+            return
+
+        # A tile is never compared with itself
+        self_pairs = np.eye(self.num_tiles, dtype=bool)[:, None, None, :, None]
+        combined = np.where(self_pairs, -np.inf, scores['combined']).astype(np.float32).ravel()
+
+        # Self pairs (-inf) sort last, so they are cut off
+        rows = combined.reshape(-1, self.num_columns)
+        num_candidates = (self.num_tiles - 1) * len(ROTATION_ANGLES)
+        index_type = np.int32 if combined.size < np.iinfo(np.int32).max else np.int64
+        self.row_order = np.argsort(-rows, axis=1, kind='stable')[:, :num_candidates].astype(index_type)
+
+        valid = np.flatnonzero(np.isfinite(combined))
+        self.ranking = valid[np.argsort(-combined[valid], kind='stable')].astype(index_type)
+        self.ranking_scores = combined[self.ranking]
+
+    def to_tensors(self):
+        """Arrays and metadata for the shared store."""
+        tensors = {f'scores.{metric}': array for metric, array in self.scores.items() if array is not None}
+        tensors.update(row_order=self.row_order, ranking=self.ranking, ranking_scores=self.ranking_scores)
+        meta = {'gridSize': self.grid_size, 'weights': self.weights, 'cnnLayer': self.cnn_layer}
+        return tensors, meta
+
+    @classmethod
+    def from_tensors(cls, tensors, meta):
+        """Result on top of (memory-mapped) arrays from the shared store."""
+        scores = {metric: tensors.get(f'scores.{metric}') for metric in METRIC_NAMES + ['combined']}
+        indexes = (tensors['row_order'], tensors['ranking'], tensors['ranking_scores'])
+        return cls(scores, meta['gridSize'], meta['weights'], meta['cnnLayer'], indexes=indexes)
+
+    def row_index(self, tile, rotation, border):
+        return (tile * len(ROTATION_ANGLES) + ROTATION_ANGLES.index(rotation)) * len(BORDER_NAMES) + BORDER_NAMES.index(border)
+
+    def best_matches(self, tile, rotation, border, k):
+        """Best K partners of one (tile, rotation, border), best first."""
+        row = self.row_index(tile, rotation, border)
+        columns = self.row_order[row, :max(0, k)]
+        return [build_match_entry(self.scores, row * self.num_columns + int(column)) for column in columns]
+
+    def pair(self, tileA, rotationA, borderA, tileB, rotationB):
+        """Score of one specific border pair."""
+        row = self.row_index(tileA, rotationA, borderA)
+        column = tileB * len(ROTATION_ANGLES) + ROTATION_ANGLES.index(rotationB)
+        return build_match_entry(self.scores, row * self.num_columns + column)
+
+    def score_range(self, min_score=None, max_score=None):
+        """[start, end) positions of the ranking with min_score <= score <= max_score."""
+        descending = -self.ranking_scores
+        start = 0 if max_score is None else int(np.searchsorted(descending, -max_score, side='left'))
+        end = len(descending) if min_score is None else int(np.searchsorted(descending, -min_score, side='right'))
+        return start, max(start, end)
+
+    def ranking_page(self, offset, limit, min_score=None, max_score=None):
+        """One page of the global ranking (best first), optionally within a score range."""
+        start, end = self.score_range(min_score, max_score)
+        page_start = min(end, start + max(0, offset))
+        page_end = min(end, page_start + max(0, limit))
+        return end - start, [build_match_entry(self.scores, int(index)) for index in self.ranking[page_start:page_end]]
+
+    def tile_pair_scores(self):
+        """
+        (tileA, tileB) matrix of the mean combined score over every rotation and
+        border of both tiles - the heatmap without the per-border list. Self pairs are None.
+        """
+        means = np.asarray(self.scores['combined'], dtype=np.float32).mean(axis=(1, 2, 4), dtype=np.float64)
+        return [
+            [None if tileA == tileB else float(means[tileA, tileB]) for tileB in range(self.num_tiles)]
+            for tileA in range(self.num_tiles)
+        ]
+
+    def top_k_matches(self, top_k):
+        """Top K matches of every (tile, rotation, border), sorted by score (descending)."""
+        k = max(0, min(top_k, self.row_order.shape[1]))
+        rows = np.arange(self.row_order.shape[0], dtype=np.int64)[:, None]
+        indices = (rows * self.num_columns + self.row_order[:, :k]).ravel()
+        combined = self.scores['combined'].ravel()
+        indices = indices[np.argsort(-combined[indices], kind='stable')]
+        return [build_match_entry(self.scores, int(index)) for index in indices]
+
+    def statistics(self):
+        return {
+            'totalComparisons': int(self.ranking_scores.size),
+            'averageCompatibility': float(np.mean(self.ranking_scores)),
+            'minCompatibility': float(self.ranking_scores[-1]),
+            'maxCompatibility': float(self.ranking_scores[0]),
+            'stdCompatibility': float(np.std(self.ranking_scores)),
+            'bestMatch': build_match_entry(self.scores, int(self.ranking[0]))
+        }
+
+
+def store_adjacency_result(result):
+    """
+    Keep a result for the query endpoints (in the shared store) and return its
+    matrixId, or None if it is larger than the whole store.
+    """
+    tensors, meta = result.to_tensors()
+    return shared_store.put('adjacency', tensors, meta)
+
+
+def get_adjacency_result(matrix_id):
+    """Stored result or None (marks it as recently used)."""
+    stored = shared_store.get(matrix_id, 'adjacency')
+    if stored is None:
+        return None
+    return AdjacencyResult.from_tensors(*stored)
+
+
+def validate_border_query(tile, rotation, border, num_tiles):
+    """Error message for an invalid (tile, rotation, border) or None."""
+    if not 0 <= tile < num_tiles:
+        return f"Invalid tile {tile} (0-{num_tiles - 1})"
+    if rotation not in ROTATION_ANGLES:
+        return f"Invalid rotation {rotation} (one of {ROTATION_ANGLES})"
+    if border not in BORDER_NAMES:
+        return f"Invalid border '{border}' (one of {BORDER_NAMES})"
+    return None
+
+
+# ============================================================================
+# COST MODEL & ADMISSION CONTROL
+# ============================================================================
+
+# Budgets (ρυθμίζονται με environment variables)
+ADMISSION_LATENCY_BUDGET = float(os.environ.get('ADMISSION_LATENCY_BUDGET', 120))  # seconds
+ADMISSION_MEMORY_BUDGET_MB = float(os.environ.get('ADMISSION_MEMORY_BUDGET_MB', 4096))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 1))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 300))  # seconds
+
+# Αρχικοί συντελεστές κόστους (δευτερόλεπτα ανά μονάδα) - διορθώνονται από τους stage timers
+DEFAULT_COST_COEFFICIENTS = {
+    'decode': 0.02,       # ανά megapixel της αρχικής εικόνας
+    'histogram': 0.01,    # ανά megapixel (tiles + borders)
+    'gabor': 0.01,        # ανά megapixel x filter
+    'cnn': 0.03,          # ανά CNN pass μέσα από ολόκληρο το MobileNetV2
+    'io': 0.0005,         # ανά εικόνα που αποθηκεύεται στο tempPhotos
+    'adjacency': 2e-9,    # ανά στοιχείο των pairwise συγκρίσεων
+    'matches': 1e-5       # ανά match entry στο JSON response
+}
+
+# Βάρος κάθε νέας μέτρησης στο calibration (exponential moving average)
+CALIBRATION_WEIGHT = 0.3
+
+# Bytes ανά αριθμό στο JSON response (Python float + list + serialization)
+JSON_VALUE_BYTES = 64
+
+# Gabor filters ανά region (4 orientations x 3 frequencies) και regions ανά tile/rotation
+GABOR_FILTERS = 12
+REGIONS_PER_TILE = 1 + len(BORDER_NAMES)
+
+
+def parse_cnn_layers(value):
+    """
+    Comma-separated ονόματα layers -> λίστα σε σειρά layer_names.
+    Άγνωστα ονόματα αγνοούνται, κενό = όλα τα layers.
+    """
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    selected = [name for name in layer_names if name in requested]
+    return selected or list(layer_names)
+
+
+def embedding_dim(layer_name, cnn_dim):
+    """Διάσταση των CNN vectors ενός layer μετά την (προαιρετική) PCA."""
+    channels = layer_channels.get(layer_name, 0)
+    return min(cnn_dim, channels) if cnn_dim > 0 else channels
+
+
+def extraction_geometry(params):
+    """
+    Διαστάσεις μετά το (πιθανώς reduced) decode για ένα extraction request.
+
+    Returns:
+        dict με megapixels της αρχικής εικόνας, scale, tile και border διαστάσεις
+    """
+    if params.get('imageSize'):
+        width, height = params['imageSize']
+    else:
+        # Άγνωστο format - συντηρητική εκτίμηση από το μέγεθος του αρχείου
+        width = height = int(math.sqrt(max(1, params.get('imageBytes', 0))))
+
+    grid_size = params['gridSize']
+    scale = 1.0
+    if params.get('maxTileSize', 0) > 0:
+        scale = min(1.0, params['maxTileSize'] * grid_size / max(width, height))
+
+    tile_height = height * scale / grid_size
+    tile_width = width * scale / grid_size
+    border_width = max(1.0, params['borderWidth'] * scale)
+
+    return {
+        'megapixels': width * height / 1e6,
+        'decodedPixels': width * height * scale * scale,
+        'tileHeight': tile_height,
+        'tileWidth': tile_width,
+        'regionPixels': tile_height * tile_width + 2 * border_width * (tile_height + tile_width)
+    }
+
+
+def extraction_units(params, geometry):
+    """
+    Μονάδες εργασίας ανά stage (στις μονάδες των DEFAULT_COST_COEFFICIENTS).
+    """
+    num_tiles = params['numTiles']
+    region_megapixels = num_tiles * geometry['regionPixels'] / 1e6
+    cnn_depth = max((layer_depth[name] for name in params['cnnLayers']), default=0.0)
+    gabor_images = REGIONS_PER_TILE * GABOR_FILTERS if params['gaborFeatures'] else 0
+
+    return {
+        'decode': geometry['megapixels'],
+        'histogram': region_megapixels,
+        'gabor': region_megapixels * len(ROTATION_ANGLES) * GABOR_FILTERS if params['gaborFeatures'] else 0.0,
+        'cnn': num_tiles * len(ROTATION_ANGLES) * REGIONS_PER_TILE * cnn_depth,
+        'io': num_tiles * len(ROTATION_ANGLES) * (len(BORDER_NAMES) + gabor_images)
+    }
+
+
+class CostModel:
+    """
+    Predicts CPU time and peak memory of the heavy endpoints from their
+    parameters. Each stage is (seconds per unit) x (units of work); the
+    per-unit costs start from DEFAULT_COST_COEFFICIENTS and are calibrated
+    from the stage timers of every completed request.
+    """
+
+    def __init__(self):
+        self.coefficients = dict(DEFAULT_COST_COEFFICIENTS)
+        self.samples = {stage: 0 for stage in DEFAULT_COST_COEFFICIENTS}
+
+    def observe(self, stage, units, seconds):
+        """Calibrate one stage with a measured time."""
+        if units <= 0 or seconds <= 0:
+            return
+        measured = seconds / units
+        if self.samples[stage] == 0:
+            self.coefficients[stage] = measured
+        else:
+            self.coefficients[stage] += CALIBRATION_WEIGHT * (measured - self.coefficients[stage])
+        self.samples[stage] += 1
+
+    def estimate_extraction(self, params):
+        """
+        Args:
+            params: dict με gridSize, borderWidth, bins, maxTileSize, gaborFeatures,
+                    cnnLayers, cnnDim, numTiles, imageSize, imageBytes
+
+        Returns:
+            dict με 'seconds', 'memoryMB' και 'stages' (seconds ανά stage)
+        """
+        geometry = extraction_geometry(params)
+        units = extraction_units(params, geometry)
+        stages = {stage: self.coefficients[stage] * amount for stage, amount in units.items()}
+
+        # JSON values ανά tile: histograms, Gabor stats, CNN vectors (4 rotations) + boundary pixels
+        values_per_rotation = REGIONS_PER_TILE * 3 * params['bins']
+        if params['gaborFeatures']:
+            values_per_rotation += REGIONS_PER_TILE * GABOR_FILTERS * 5
+        values_per_rotation += REGIONS_PER_TILE * sum(
+            embedding_dim(name, params.get('cnnDim', 0)) + 8 for name in params['cnnLayers']
+        )
+        profile_length = min(geometry['tileHeight'], geometry['tileWidth'])
+        values_per_tile = len(ROTATION_ANGLES) * values_per_rotation + len(BORDER_NAMES) * 2 * profile_length * 3
+
+        memory_bytes = (
+            params.get('imageBytes', 0) +
+            geometry['decodedPixels'] * 3 +
+            params['numTiles'] * values_per_tile * JSON_VALUE_BYTES
+        )
+
+        return {
+            'seconds': sum(stages.values()),
+            'memoryMB': memory_bytes / 2 ** 20,
+            'stages': stages
+        }
+
+    def observe_extraction(self, params, image_shape, border_width, timings):
+        """Calibrate from the stage timers of a finished /api/calculate-histograms request."""
+        height, width = image_shape[:2]
+        tile_height = height // params['gridSize']
+        tile_width = width // params['gridSize']
+        geometry = {
+            'megapixels': extraction_geometry(params)['megapixels'],
+            'regionPixels': tile_height * tile_width + 2 * border_width * (tile_height + tile_width)
+        }
+        for stage, units in extraction_units(params, geometry).items():
+            self.observe(stage, units, timings.get(stage, 0.0))
+
+    def adjacency_units(self, params):
+        """Pairwise elements and JSON match entries of an adjacency request."""
+        rows = params['numTiles'] * len(ROTATION_ANGLES)
+        pairs = rows * rows * len(BORDER_NAMES)
+        elements_per_pair = {
+            'color': 3 * params['bins'] * 3,
+            'gabor': 36 * 3,
+            'cnn': params['cnnChannels'] * 2,
+            'pixel': params['profileLength'] * 3 * 4
+        }
+        # + sorting/indexing of the score arrays
+        elements = pairs * (32 + sum(
+            elements_per_pair[metric] for metric in METRIC_NAMES if params['weights'].get(metric, 0.0) > 0
+        ))
+        matches = rows * len(BORDER_NAMES) * params['topK'] if params['includeMatrix'] else 0
+        return pairs, elements, matches
+
+    def estimate_adjacency(self, params):
+        """
+        Args:
+            params: dict με numTiles, bins, cnnChannels, profileLength, weights, topK, includeMatrix
+
+        Returns:
+            dict με 'seconds', 'memoryMB' και 'stages'
+        """
+        pairs, elements, matches = self.adjacency_units(params)
+        active_metrics = sum(1 for metric in METRIC_NAMES if params['weights'].get(metric, 0.0) > 0)
+        stages = {
+            'adjacency': self.coefficients['adjacency'] * elements,
+            'matches': self.coefficients['matches'] * matches
+        }
+
+        # Score arrays (float32), row_order (int32), ranking (int64 + float32), pairwise chunks, response
+        memory_bytes = (
+            pairs * 4 * (1 + active_metrics) +
+            pairs * (4 + 12) +
+            PAIRWISE_CHUNK_ELEMENTS * 4 * 3 +
+            matches * 16 * JSON_VALUE_BYTES
+        )
+
+        return {
+            'seconds': sum(stages.values()),
+            'memoryMB': memory_bytes / 2 ** 20,
+            'stages': stages
+        }
+
+
+def downgrade_cnn_dim(applied):
+    """PCA-compressed CNN embeddings (64 διαστάσεις) - μικρότερο payload."""
+    if not applied['cnnLayers'] or 0 < applied['cnnDim'] <= 64:
+        return False
+    applied['cnnDim'] = 64
+    return True
+
+
+def downgrade_cnn_layers(applied):
+    """Μόνο τα layers μέχρι το block_6 (φθηνότερο truncated model, μικρότερα vectors)."""
+    limit = layer_names.index('block_6_expand_relu')
+    layers = [name for name in applied['cnnLayers'] if layer_names.index(name) <= limit]
+    if not applied['cnnLayers'] or layers == applied['cnnLayers']:
+        return False
+    applied['cnnLayers'] = layers or ['block_6_expand_relu']
+    return True
+
+
+def downgrade_bins(applied):
+    if applied['bins'] <= 32:
+        return False
+    applied['bins'] = 32
+    return True
+
+
+def downgrade_tile_size(applied, max_tile_size):
+    if 0 < applied['maxTileSize'] <= max_tile_size:
+        return False
+    applied['maxTileSize'] = max_tile_size
+    return True
+
+
+def downgrade_gabor(applied):
+    if not applied['gaborFeatures']:
+        return False
+    applied['gaborFeatures'] = False
+    return True
+
+
+def downgrade_cnn(applied):
+    if not applied['cnnLayers']:
+        return False
+    applied['cnnLayers'] = []
+    return True
+
+
+# Σειρά υποβάθμισης ενός extraction request (από το φθηνότερο σε ποιότητα)
+EXTRACTION_DOWNGRADES = [
+    ('compressedCnn', downgrade_cnn_dim),
+    ('fewerCnnLayers', downgrade_cnn_layers),
+    ('reducedBins', downgrade_bins),
+    ('smallerTiles', lambda applied: downgrade_tile_size(applied, 224)),
+    ('noGabor', downgrade_gabor),
+    ('noCnn', downgrade_cnn),
+    ('smallestTiles', lambda applied: downgrade_tile_size(applied, 64))
+]
+
+
+def downgrade_metric(applied, metric):
+    """Drop one metric and rescale the remaining weights to the same total."""
+    weights = applied['weights']
+    if weights.get(metric, 0.0) <= 0:
+        return False
+    remaining = {name: value for name, value in weights.items() if name != metric and value > 0}
+    if not remaining:
+        return False
+    scale = sum(weights.values()) / sum(remaining.values())
+    applied['weights'] = {name: value * scale for name, value in remaining.items()}
+    return True
+
+
+def downgrade_matrix(applied):
+    if not applied['includeMatrix']:
+        return False
+    applied['includeMatrix'] = False
+    return True
+
+
+# Σειρά υποβάθμισης ενός adjacency request
+ADJACENCY_DOWNGRADES = [
+    ('noCnnMetric', lambda applied: downgrade_metric(applied, 'cnn')),
+    ('noGaborMetric', lambda applied: downgrade_metric(applied, 'gabor')),
+    ('noMatrixInResponse', downgrade_matrix)
+]
+
+
+class AdmissionController:
+    """
+    Decides, before any heavy work starts, whether a request is accepted,
+    downgraded (cheaper parameters) to fit the latency/memory budget, queued
+    behind the running requests, or rejected.
+    """
+
+    def __init__(self, model, latency_budget, memory_budget_mb, max_concurrent, queue_timeout):
+        self.cost_model = model
+        self.latency_budget = latency_budget
+        self.memory_budget_mb = memory_budget_mb
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+
+    def fits(self, estimate):
+        return estimate['seconds'] <= self.latency_budget and estimate['memoryMB'] <= self.memory_budget_mb
+
+    def plan(self, requested, applied, estimator, downgrades, allow_downgrade):
+        estimate = estimator({**requested, **applied})
+        applied_downgrades = []
+        if allow_downgrade:
+            for name, downgrade in downgrades:
+                if self.fits(estimate):
+                    break
+                if downgrade(applied):
+                    applied_downgrades.append(name)
+                    estimate = estimator({**requested, **applied})
+
+        decision = {
+            'decision': 'downgraded' if applied_downgrades else 'accepted',
+            'queued': self.active >= self.max_concurrent,
+            'downgrades': applied_downgrades,
+            'applied': applied,
+            'estimate': estimate,
+            'budget': {'seconds': self.latency_budget, 'memoryMB': self.memory_budget_mb}
+        }
+        if not self.fits(estimate):
+            decision['decision'] = 'rejected'
+            decision['message'] = (
+                f"Estimated cost {estimate['seconds']:.1f}s / {estimate['memoryMB']:.0f}MB exceeds the budget "
+                f"{self.latency_budget:.0f}s / {self.memory_budget_mb:.0f}MB"
+            )
+        elif decision['queued'] and not applied_downgrades:
+            decision['decision'] = 'queued'
+        return decision
+
+    def plan_extraction(self, requested, allow_downgrade=True):
+        applied = {key: requested[key] for key in ('bins', 'maxTileSize', 'gaborFeatures', 'cnnLayers', 'cnnDim')}
+        applied['cnnLayers'] = list(applied['cnnLayers'])
+        return self.plan(
+            requested, applied, self.cost_model.estimate_extraction, EXTRACTION_DOWNGRADES, allow_downgrade
+        )
+
+    def plan_adjacency(self, requested, allow_downgrade=True):
+        applied = {'weights': dict(requested['weights']), 'includeMatrix': requested['includeMatrix']}
+        return self.plan(
+            requested, applied, self.cost_model.estimate_adjacency, ADJACENCY_DOWNGRADES, allow_downgrade
+        )
+
+    async def acquire(self):
+        """Wait for a free slot; returns the queued seconds or None on timeout."""
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.active += 1
+        return time.perf_counter() - start
+
+    def release(self):
+        self.active -= 1
+        self.slots.release()
+
+
+cost_model = CostModel()
+admission_controller = AdmissionController(
+    cost_model,
+    latency_budget=ADMISSION_LATENCY_BUDGET,
+    memory_budget_mb=ADMISSION_MEMORY_BUDGET_MB,
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT
+)
+
+
+@app.get("/api/admission")
+async def get_admission_status():
+    """
+    Budgets, current load and calibrated cost coefficients of the admission controller.
+    """
+    return {
+        'status': 'success',
+        'budget': {
+            'seconds': admission_controller.latency_budget,
+            'memoryMB': admission_controller.memory_budget_mb
+        },
+        'maxConcurrent': admission_controller.max_concurrent,
+        'active': admission_controller.active,
+        'coefficients': cost_model.coefficients,
+        'samples': cost_model.samples
+    }
+
+
+# Φάκελος για τα border strips / Gabor images (αδειάζει σε κάθε request).
+# Default: tempPhotos στο root - το backend τρέχει από τον φάκελο backend
+TEMP_PHOTOS_DIR = Path(os.environ.get('TEMP_PHOTOS_DIR', Path(__file__).parent.parent / 'tempPhotos'))
+
+
+def extract_tile_features(img, tiles_data, grid_size, border_width, bins, gabor_features, cnn_layers, timings):
+    """
+    Υπολογίζει όλα τα features των tiles (η βαριά δουλειά του /api/calculate-histograms).
+
+    Args:
+        img: BGR εικόνα (ήδη decoded)
+        tiles_data: λίστα με tile metadata (sourceIndex, destPosition, rotation)
+        grid_size: μέγεθος grid
+        border_width: πλάτος border σε pixels της decoded εικόνας
+        bins: αριθμός bins για histograms
+        gabor_features: False = χωρίς Gabor features
+        cnn_layers: λίστα με CNN layers (κενή = χωρίς CNN features)
+        timings: dict stage -> seconds, συμπληρώνεται με τους χρόνους κάθε σταδίου
+
+    Returns:
+        tuple (results, saved_images, temp_photos_dir)
+    """
+    # Strided view (grid, grid, th, tw, 3) - τα tiles είναι views, όχι αντίγραφα
+    tiles_view = tile_grid_view(img, grid_size)
+
+    # Φάκελος tempPhotos (TEMP_PHOTOS_DIR)
+    temp_photos_dir = TEMP_PHOTOS_DIR
+
+    # Διαγραφή παλιού φακέλου αν υπάρχει και δημιουργία νέου
+    if temp_photos_dir.exists():
+        shutil.rmtree(temp_photos_dir)
+    temp_photos_dir.mkdir(parents=True, exist_ok=True)
+
+    saved_images = []
+    results = []
+
+    # Δημιουργία υποφακέλου για Gabor filtered images
+    gabor_dir = temp_photos_dir / "gabor_filters"
+    gabor_dir.mkdir(exist_ok=True)
+
+    for stage in ('histogram', 'gabor', 'cnn', 'io'):
+        timings.setdefault(stage, 0.0)
+
+    # Color histograms για όλα τα tiles/borders/rotations με ένα vectorized pass
+    stage_start = time.perf_counter()
+    tile_histograms, border_histogram_array = calculate_tile_histograms(
+        img, [tile_meta['sourceIndex'] for tile_meta in tiles_data], grid_size, border_width, bins=bins
+    )
+    timings['histogram'] += time.perf_counter() - stage_start
+
+    # Κενά αποτελέσματα για features που έχουν απενεργοποιηθεί
+    no_gabor = {'responses': [], 'features': [], 'num_filters': 0}
+    no_cnn = {'num_layers': 0, 'layers': []}
+
+    def timed(stage, function, *args, **kwargs):
+        stage_start = time.perf_counter()
+        value = function(*args, **kwargs)
+        timings[stage] += time.perf_counter() - stage_start
+        return value
+
+    def save_gabor_responses(responses, filename_prefix):
+        for filter_idx, gabor_response in enumerate(responses):
+            # Normalize στο [0, 255] για αποθήκευση
+            gabor_normalized = cv2.normalize(gabor_response, None, 0, 255, cv2.NORM_MINMAX)
+            gabor_uint8 = gabor_normalized.astype(np.uint8)
+
+            # Αποθήκευση
+            gabor_filepath = gabor_dir / f"{filename_prefix}_gabor_{filter_idx}.jpg"
+            cv2.imwrite(str(gabor_filepath), gabor_uint8)
+
+    # Για κάθε tile (sourceIndex), υπολογίζουμε features για όλες τις rotations
+    for idx, tile_meta in enumerate(tiles_data):
+        source_index = tile_meta['sourceIndex']
+        dest_position = tile_meta['destPosition']
+        shuffle_rotation = tile_meta['rotation']  # Η rotation από το shuffle (για reference)
+
+        # Dictionary για να αποθηκεύσουμε features για κάθε rotation
+        rotation_features = {}
+
+        # Υπολογισμός features για όλες τις πιθανές rotations
+        for rotation_index, rotation_angle in enumerate(ROTATION_ANGLES):
+            # Tile με αυτή τη rotation (view πάνω στην εικόνα)
+            tile = rotate_tile_view(
+                tiles_view[source_index // grid_size, source_index % grid_size], rotation_angle
+            )
+
+            # Histogram για ολόκληρο το tile (ίδιο για όλες τις rotations)
+            tile_histogram = histogram_to_dict(tile_histograms[idx])
+
+            # Εφαρμογή Gabor filters στο tile
+            tile_gabor = timed('gabor', apply_gabor_filters, tile, num_orientations=4, num_frequencies=3) if gabor_features else no_gabor
+
+            # Εξαγωγή CNN features από το tile
+            tile_cnn = timed('cnn', extract_cnn_features, tile, cnn_layers) if cnn_layers else no_cnn
+
+            # Αποθήκευση Gabor filtered images για το tile
+            timed('io', save_gabor_responses, tile_gabor['responses'], f"tile_{idx}_rot{rotation_angle}")
+
+            # Εξαγωγή border strips
+            borders = extract_border_strips(tile, border_width)
+
+            # Υπολογισμός histogram, Gabor και CNN features για κάθε border
+            border_histograms = {}
+            border_gabor_features = {}
+            border_cnn_features = {}
+
+            # Αποθήκευση κάθε border strip ως εικόνα
+            for border_index, border_name in enumerate(BORDER_NAMES):
+                border_img = borders[border_name]
+
+                # Histogram για το border (από το batch)
+                border_histograms[border_name] = histogram_to_dict(
+                    border_histogram_array[idx, rotation_index, border_index]
+                )
+
+                # Εφαρμογή Gabor filters στο border
+                border_gabor = timed('gabor', apply_gabor_filters, border_img, num_orientations=4, num_frequencies=3) if gabor_features else no_gabor
+                border_gabor_features[border_name] = border_gabor['features']
+
+                # Εξαγωγή CNN features από το border
+                border_cnn = timed('cnn', extract_cnn_features, border_img, cnn_layers) if cnn_layers else no_cnn
+                border_cnn_features[border_name] = border_cnn['layers']
+
+                # Αποθήκευση Gabor filtered images για το border
+                timed('io', save_gabor_responses, border_gabor['responses'], f"tile_{idx}_rot{rotation_angle}_{border_name}")
+
+                # Όνομα αρχείου: tile_0_rot90_top.jpg, κλπ.
+                filename = f"tile_{idx}_src{source_index}_rot{rotation_angle}_{border_name}.jpg"
+                filepath = temp_photos_dir / filename
+
+                # Αποθήκευση εικόνας (ήδη σε BGR format)
+                timed('io', cv2.imwrite, str(filepath), border_img)
+
+                saved_images.append(filename)
+
+            # Αποθήκευση features για αυτή τη rotation
+            # Use string keys for JSON compatibility
+            rotation_features[str(rotation_angle)] = {
+                'tileHistogram': tile_histogram,
+                'borderHistograms': border_histograms,
+                'tileGaborFeatures': tile_gabor['features'],
                 'borderGaborFeatures': border_gabor_features,
                 'tileCnnFeatures': tile_cnn['layers'],
                 'borderCnnFeatures': border_cnn_features
             }
 
+        # Boundary pixels μόνο στις 0° - οι υπόλοιπες rotations προκύπτουν
+        # στο backend με rotate_boundary_profiles (4x μικρότερο payload)
+        boundary_profiles = extract_boundary_profiles(
+            tiles_view[source_index // grid_size, source_index % grid_size]
+        )
+
         # Αποθήκευση αποτελεσμάτων με rotation-invariant features
         results.append({
             'sourceIndex': source_index,
             'destPosition': dest_position,
             'shuffleRotation': shuffle_rotation,  # Η αρχική rotation από το shuffle
-            'rotationFeatures': rotation_features  # Features για όλες τις rotations
+            'rotationFeatures': rotation_features,  # Features για όλες τις rotations
+            'boundaryPixels': {
+                border_name: boundary_profiles[border_index].tolist()
+                for border_index, border_name in enumerate(BORDER_NAMES)
+            }
+        })
+
+    return results, saved_images, temp_photos_dir
+
+
+@app.post("/api/calculate-histograms")
+async def calculate_histograms(
+    image: UploadFile = File(...),
+    gridSize: int = Form(...),
+    borderWidth: int = Form(...),
+    bins: int = Form(256),  # Αριθμός bins για histograms (default: 256)
+    maxTileSize: int = Form(0),  # Μέγιστο μέγεθος tile σε pixels κατά το decode (0 = πλήρης ανάλυση)
+    gaborFeatures: bool = Form(True),  # False = χωρίς Gabor features
+    cnnFeatures: bool = Form(True),  # False = χωρίς CNN features (CNN-free mode με το pixel metric)
+    cnnLayers: str = Form(''),  # Comma-separated CNN layers (κενό = όλα τα layer_names)
+    cnnDim: int = Form(0),  # Διάσταση των CNN embeddings μετά την PCA (0 = χωρίς PCA)
+    cnnPrecision: str = Form('float32'),  # 'float16' ή 'float32'
+    cnnBasisId: str = Form(''),  # PCA basis από προηγούμενο request (ίδιο dataset) αντί για fit ανά εικόνα
+    saveCnnBasis: bool = Form(False),  # True = το PCA basis αποθηκεύεται ως dataset basis (cnnBasisId)
+    allowDowngrade: bool = Form(True),  # Επιτρέπει στο admission control να μειώσει το κόστος
+    tiles: str = Form(...)  # JSON string με tile metadata
+):
+    """
+    Endpoint που:
+    1. Δέχεται εικόνα + metadata
+    2. Για κάθε tile, υπολογίζει features για ΟΛΕΣ τις πιθανές rotations (0°, 90°, 180°, 270°)
+    3. Εξάγει border strips για κάθε rotation
+    4. Αποθηκεύει τα border strips ως εικόνες στο tempPhotos
+    5. Υπολογίζει color histograms, Gabor features και CNN features για κάθε border
+
+    Με maxTileSize > 0 η εικόνα γίνεται decode σε μειωμένη ανάλυση (για πολύ
+    μεγάλα scans) και το borderWidth κλιμακώνεται αναλογικά.
+
+    Επιστρέφει επίσης τα boundary pixels κάθε tile (στις 0°) για το pixel
+    metric του adjacency matrix. Με gaborFeatures/cnnFeatures = False τα
+    αντίστοιχα features παραλείπονται (κενές λίστες).
+
+    Τα CNN vectors επιστρέφονται normalized (unit length), προαιρετικά
+    προβεβλημένα με PCA σε cnnDim διαστάσεις και σε float16/float32
+    ακρίβεια. Με saveCnnBasis = True το basis αποθηκεύεται στο shared store
+    ('cnnCompression.basisId') και μπορεί να ξαναχρησιμοποιηθεί με το cnnBasisId
+    για όλες τις εικόνες ενός dataset (το cnnDim πρέπει τότε να είναι 0 ή ίσο
+    με τη διάσταση του basis). Τα αποθηκευμένα bases δεν γίνονται evict -
+    διαγράφονται με DELETE /api/cnn-basis/{basisId}. Χωρίς saveCnnBasis το
+    basis ανά εικόνα δεν αποθηκεύεται. Το 'cnnCompression' περιέχει ανά layer
+    το accuracy tradeoff (cosine error, nearest neighbour agreement) και το
+    compression ratio.
+
+    Τα features αποθηκεύονται και ως stacked tensors στο shared store
+    ('featureSetId'), ώστε το /api/calculate-adjacency-matrix να τα κάνει
+    attach σε οποιονδήποτε worker χωρίς να τα ξαναφτιάξει από το JSON. Αν δεν
+    χωράνε στο store το featureSetId (και το basisId) είναι null και το adjacency
+    matrix χρησιμοποιεί τα results του JSON.
+
+    Πριν από τον υπολογισμό το admission control εκτιμά χρόνο/μνήμη και
+    δέχεται, βάζει σε ουρά, υποβαθμίζει (λιγότερα CNN layers, λιγότερα bins,
+    μικρότερα tiles, χωρίς Gabor/CNN) ή απορρίπτει το request. Η απόφαση
+    επιστρέφεται στο 'admission' και οι χρόνοι κάθε σταδίου στο 'timings'.
+    """
+    # Διάβασμα εικόνας
+    contents = await image.read()
+
+    # Parse tile metadata
+    tiles_data = json.loads(tiles)
+
+    if cnnPrecision not in EMBEDDING_PRECISIONS:
+        return {'status': 'error', 'message': f"Invalid cnnPrecision '{cnnPrecision}' (one of {list(EMBEDDING_PRECISIONS)})"}
+
+    # Ένα αποθηκευμένο basis ορίζει τη διάσταση των embeddings: cnnDim = 0 την υιοθετεί,
+    # διαφορετικό cnnDim απορρίπτεται (τα vectors δεν θα ήταν συγκρίσιμα με το dataset)
+    stored_basis = shared_store.get(cnnBasisId, 'cnnBasis') if cnnBasisId else None
+    if stored_basis is not None:
+        basis_dim = stored_basis[1]['dim']
+        if cnnDim > 0 and cnnDim != basis_dim:
+            return {
+                'status': 'error',
+                'message': f"cnnBasisId '{cnnBasisId}' projects to {basis_dim} dimensions, cnnDim={cnnDim} was requested (use cnnDim={basis_dim} or 0)"
+            }
+        cnnDim = basis_dim
+
+    requested = {
+        'gridSize': gridSize,
+        'borderWidth': borderWidth,
+        'bins': bins,
+        'maxTileSize': maxTileSize,
+        'gaborFeatures': gaborFeatures,
+        'cnnLayers': parse_cnn_layers(cnnLayers) if cnnFeatures and tf is not None else [],
+        'cnnDim': max(0, cnnDim),
+        'numTiles': len(tiles_data),
+        'imageSize': read_image_size(contents),
+        'imageBytes': len(contents)
+    }
+    admission = admission_controller.plan_extraction(requested, allow_downgrade=allowDowngrade)
+    if admission['decision'] == 'rejected':
+        return {'status': 'error', 'message': admission['message'], 'admission': admission}
+
+    queued_seconds = await admission_controller.acquire()
+    if queued_seconds is None:
+        admission['decision'] = 'rejected'
+        admission['message'] = 'Timed out waiting for a free worker slot'
+        return {'status': 'error', 'message': admission['message'], 'admission': admission}
+    admission['queuedSeconds'] = queued_seconds
+
+    applied = admission['applied']
+    timings = {}
+    try:
+        # Και το decode τρέχει σε thread - ένα τεράστιο scan δεν μπλοκάρει την ουρά
+        stage_start = time.perf_counter()
+        img, decode_scale = await asyncio.to_thread(decode_image, contents, gridSize, applied['maxTileSize'])
+        del contents
+        timings['decode'] = time.perf_counter() - stage_start
+        # Η εικόνα είναι σε BGR format (cv2.imdecode επιστρέφει BGR)
+        # ΔΕΝ μετατρέπουμε σε RGB γιατί όλες οι συναρτήσεις μας δουλεύουν με BGR
+
+        # Το border width ορίζεται σε pixels της αρχικής εικόνας
+        border_width = max(1, int(round(borderWidth * min(decode_scale))))
+
+        # Η βαριά δουλειά τρέχει σε thread ώστε το event loop να εξυπηρετεί την ουρά
+        results, saved_images, temp_photos_dir = await asyncio.to_thread(
+            extract_tile_features, img, tiles_data, gridSize, border_width,
+            applied['bins'], applied['gaborFeatures'], applied['cnnLayers'], timings
+        )
+
+        # Compression των CNN embeddings (PCA basis ανά εικόνα ή από το cnnBasisId)
+        stage_start = time.perf_counter()
+        # Αν το admission control μείωσε το cnnDim το basis δεν ταιριάζει πια - fit ανά εικόνα
+        if stored_basis is not None and stored_basis[1]['dim'] != applied['cnnDim']:
+            stored_basis = None
+        bases = dict(stored_basis[0]) if stored_basis else {}
+        reused_layers = set(bases)
+        compression_reports = await asyncio.to_thread(
+            compress_tile_cnn_features, results, applied['cnnLayers'], applied['cnnDim'], cnnPrecision, bases
+        )
+        basis_id = cnnBasisId if stored_basis else None
+        if saveCnnBasis and bases and not set(bases) <= reused_layers:
+            # Dataset basis κατόπιν αιτήματος: δεν γίνεται evict από την κίνηση των features/matrices
+            basis_id = await asyncio.to_thread(shared_store.put, 'cnnBasis', bases, {'dim': applied['cnnDim']}, pinned=True)
+        timings['compress'] = time.perf_counter() - stage_start
+
+        # Stacked features στο shared store ώστε το adjacency matrix να τα βρει σε οποιονδήποτε worker
+        stage_start = time.perf_counter()
+        feature_tensors = await asyncio.to_thread(
+            stack_tile_features, results, applied['cnnLayers'], EMBEDDING_PRECISIONS[cnnPrecision][0]
+        )
+        # Το np.save εκατοντάδων MB τρέχει κι αυτό σε thread
+        feature_set_id = await asyncio.to_thread(shared_store.put, 'features', feature_tensors, {
+            'gridSize': gridSize,
+            'numTiles': len(results),
+            'bins': applied['bins'],
+            'cnnLayers': applied['cnnLayers'],
+            'cnnDim': applied['cnnDim']
         })
+        timings['store'] = time.perf_counter() - stage_start
+    finally:
+        admission_controller.release()
+
+    # Calibration του cost model με τους πραγματικούς χρόνους
+    cost_model.observe_extraction({**requested, **applied}, img.shape, border_width, timings)
 
     return {
         'status': 'success',
         'gridSize': gridSize,
         'borderWidth': borderWidth,
-        'bins': bins,
+        'bins': applied['bins'],
+        'decodeScale': list(decode_scale),
+        'decodedSize': [int(img.shape[1]), int(img.shape[0])],
+        'effectiveBorderWidth': border_width,
+        'gaborFeatures': applied['gaborFeatures'],
+        'cnnFeatures': bool(applied['cnnLayers']),
+        'cnnLayers': applied['cnnLayers'],
+        'cnnCompression': {
+            'dim': applied['cnnDim'],
+            'precision': cnnPrecision,
+            'basisId': basis_id,
+            'basisReused': sorted(reused_layers & set(compression_reports)),
+            'layers': compression_reports
+        },
         'totalTiles': len(tiles_data),
         'totalRotations': 4,  # Για κάθε tile υπολογίζουμε 4 rotations
         'totalImages': len(saved_images),
         'message': f'Calculated rotation-invariant features for {len(tiles_data)} tiles (4 rotations each). Saved {len(saved_images)} border strip images to tempPhotos/',
         'outputPath': str(temp_photos_dir),
+        'featureSetId': feature_set_id,
+        'admission': admission,
+        'timings': timings,
         'results': results
     }
 
@@ -665,19 +2338,32 @@ async def calculate_adjacency_matrix(data: dict):
     Input (JSON):
         {
             "histogramData": dict (full response from /api/calculate-histograms),
-            "weights": dict (optional, default: {"color": 0.4, "gabor": 0.3, "cnn": 0.3}),
+            "featureSetId": str (optional, default: histogramData.featureSetId - stacked
+                                 features in the shared store; histogramData.results
+                                 may then be omitted),
+            "weights": dict (optional, default: {"color": 0.4, "gabor": 0.3, "cnn": 0.3};
+                             also accepts "pixel" - zero/missing weights are not computed),
             "cnnLayer": str (optional, default: "block_6_expand_relu"),
-            "topK": int (optional, default: 10 - top K matches per tile-border pair)
+            "topK": int (optional, default: 10 - top K matches per tile-border pair),
+            "includeMatrix": bool (optional, default: true - false omits "adjacencyMatrix";
+                                   query it through /api/adjacency/{matrixId}/... instead),
+            "allowDowngrade": bool (optional, default: true - admission control may drop the
+                                    cnn/gabor metrics or the matrix to fit the budget)
         }
 
     Output (JSON):
         {
             "status": "success",
+            "matrixId": str (id of the server-side result for the query API; null if
+                             it does not fit the shared store - adjacencyMatrix is then
+                             always included),
             "gridSize": int,
             "totalTiles": int,
             "weights": dict,
             "cnnLayer": str,
             "topK": int,
+            "admission": dict (decision, estimate, applied weights/includeMatrix),
+            "timings": dict (seconds per stage),
             "adjacencyMatrix": [
                 {
                     "tileA": int,
@@ -686,7 +2372,7 @@ async def calculate_adjacency_matrix(data: dict):
                     "borderB": str,
                     "rotation": int,
                     "compatibilityScore": float,
-                    "scores": {"color": float, "gabor": float, "cnn": float}
+                    "scores": {"color": float, "gabor": float, "cnn": float, "pixel": float}
                 },
                 ...
             ],
@@ -706,133 +2392,591 @@ async def calculate_adjacency_matrix(data: dict):
     weights = data.get('weights', {'color': 0.4, 'gabor': 0.3, 'cnn': 0.3})
     cnn_layer = data.get('cnnLayer', 'block_6_expand_relu')
     top_k = data.get('topK', 10)
+    include_matrix = data.get('includeMatrix', True)
+    allow_downgrade = data.get('allowDowngrade', True)
+
+    # Stacked features από το shared store (υπολογισμένα από οποιονδήποτε worker)
+    feature_set_id = data.get('featureSetId') or (histogram_data or {}).get('featureSetId')
+    feature_set = shared_store.get(feature_set_id, 'features') if feature_set_id else None
+
+    if feature_set is not None:
+        stored_features, feature_meta = feature_set
+        tiles = None
+        grid_size = feature_meta['gridSize']
+        num_tiles = feature_meta['numTiles']
+        bins = feature_meta['bins']
+        cnn_dim = feature_meta.get('cnnDim', 0)
+        has_boundary_pixels = 'pixel' in stored_features
+        profile_length = stored_features['pixel'].shape[4] if has_boundary_pixels else 0
+    else:
+        # Validation
+        if not histogram_data or 'results' not in histogram_data:
+            message = "Invalid histogram data"
+            if feature_set_id:
+                message = f"Unknown featureSetId '{feature_set_id}' (expired) and no histogram results to fall back to"
+            return {"status": "error", "message": message}
+
+        tiles = histogram_data['results']
+        grid_size = histogram_data['gridSize']
+        num_tiles = len(tiles)
+        bins = histogram_data.get('bins', 256)
+        cnn_dim = histogram_data.get('cnnCompression', {}).get('dim', 0)
+
+        # Check if data has new rotation-aware structure
+        if len(tiles) > 0:
+            first_tile = tiles[0]
+            if 'rotationFeatures' not in first_tile:
+                return {
+                    "status": "error",
+                    "message": "Histogram data has old structure. Please recalculate histograms with 'Send to Backend' button first!"
+                }
 
-    # Validation
-    if not histogram_data or 'results' not in histogram_data:
-        return {"status": "error", "message": "Invalid histogram data"}
+        boundary_pixels = tiles[0].get('boundaryPixels') or {} if tiles else {}
+        has_boundary_pixels = bool(boundary_pixels)
+        profile_length = len(boundary_pixels['top'][0]) if 'top' in boundary_pixels else 0
 
-    tiles = histogram_data['results']
-    grid_size = histogram_data['gridSize']
+    print(f"Calculating adjacency matrix for {num_tiles} tiles with rotation-aware features...")
+    print(f"Weights: {weights}, CNN Layer: {cnn_layer}, TopK: {top_k}")
 
-    # Check if data has new rotation-aware structure
-    if len(tiles) > 0:
-        first_tile = tiles[0]
-        if 'rotationFeatures' not in first_tile:
-            return {
-                "status": "error",
-                "message": "Histogram data has old structure. Please recalculate histograms with 'Send to Backend' button first!"
+    if num_tiles < 2:
+        return {"status": "error", "message": "Need at least 2 tiles to calculate an adjacency matrix"}
+
+    if weights.get('pixel', 0.0) > 0 and not has_boundary_pixels:
+        return {
+            "status": "error",
+            "message": "Histogram data has no boundary pixels. Please recalculate histograms with 'Send to Backend' button first!"
+        }
+
+    requested = {
+        'numTiles': num_tiles,
+        'bins': bins,
+        'cnnChannels': embedding_dim(cnn_layer, cnn_dim),
+        'profileLength': profile_length,
+        'weights': weights,
+        'topK': top_k,
+        'includeMatrix': include_matrix
+    }
+    admission = admission_controller.plan_adjacency(requested, allow_downgrade=allow_downgrade)
+    if admission['decision'] == 'rejected':
+        return {'status': 'error', 'message': admission['message'], 'admission': admission}
+
+    weights = admission['applied']['weights']
+    include_matrix = admission['applied']['includeMatrix']
+
+    def score_all_pairs():
+        # Only stack the features of metrics that are actually used
+        if feature_set is not None:
+            metric_stackers = {
+                'color': lambda: stored_features.get('color'),
+                'gabor': lambda: stored_features.get('gabor'),
+                'cnn': lambda: stored_features.get(f'cnn.{cnn_layer}'),
+                'pixel': lambda: stored_features.get('pixel')
+            }
+        else:
+            metric_stackers = {
+                'color': lambda: stack_border_histograms(tiles),
+                'gabor': lambda: stack_border_gabor(tiles),
+                'cnn': lambda: stack_border_cnn(tiles, cnn_layer),
+                'pixel': lambda: stack_boundary_profiles(tiles)
             }
+        features = {
+            metric: stacker() if weights.get(metric, 0.0) > 0 else None
+            for metric, stacker in metric_stackers.items()
+        }
 
-    print(f"Calculating adjacency matrix for {len(tiles)} tiles with rotation-aware features...")
-    print(f"Weights: {weights}, CNN Layer: {cnn_layer}, TopK: {top_k}")
+        # Scores for all (tileA, rotationA, borderA, tileB, rotationB) in one pass
+        scores = compute_compatibility_scores(features, weights, num_tiles)
+        return AdjacencyResult(scores, grid_size, weights, cnn_layer)
+
+    queued_seconds = await admission_controller.acquire()
+    if queued_seconds is None:
+        admission['decision'] = 'rejected'
+        admission['message'] = 'Timed out waiting for a free worker slot'
+        return {'status': 'error', 'message': admission['message'], 'admission': admission}
+    admission['queuedSeconds'] = queued_seconds
+
+    timings = {}
+    # Το feature set δεν γίνεται evict όσο το χρησιμοποιούμε
+    retained = feature_set is not None and shared_store.retain(feature_set_id)
+    try:
+        stage_start = time.perf_counter()
+        result = await asyncio.to_thread(score_all_pairs)
+        timings['adjacency'] = time.perf_counter() - stage_start
+    finally:
+        admission_controller.release()
+        if retained:
+            shared_store.release(feature_set_id)
+
+    # Κρατάμε το matrix στο backend για το query API (/api/adjacency/{matrixId}/...)
+    stage_start = time.perf_counter()
+    matrix_id = await asyncio.to_thread(store_adjacency_result, result)
+    timings['store'] = time.perf_counter() - stage_start
+    if matrix_id is None:
+        # Δεν χωράει στο shared store: το αποτέλεσμα επιστρέφεται από τη μνήμη, χωρίς
+        # query API, οπότε η λίστα των matches είναι ο μόνος τρόπος να διαβαστεί
+        include_matrix = True
+
+    statistics = result.statistics()
+    print(f"Total comparisons: {statistics['totalComparisons']} (with rotation-aware features)")
+
+    response = {
+        'status': 'success',
+        'matrixId': matrix_id,
+        'gridSize': grid_size,
+        'totalTiles': num_tiles,
+        'weights': weights,
+        'cnnLayer': cnn_layer,
+        'topK': top_k,
+        'admission': admission,
+        'timings': timings,
+        'statistics': statistics
+    }
+    if matrix_id is None:
+        response['message'] = (
+            f'The adjacency matrix of {num_tiles} tiles does not fit the shared store '
+            f'(SHARED_STORE_MAX_MB={SHARED_STORE_MAX_MB:g}) - returned without matrixId and query API'
+        )
+
+    # For each tile-rotation-border combination, keep only top K matches
+    statistics['filteredMatches'] = 0
+    if include_matrix:
+        stage_start = time.perf_counter()
+        filtered_matches = result.top_k_matches(top_k)
+        timings['matches'] = time.perf_counter() - stage_start
+        response['adjacencyMatrix'] = filtered_matches
+        statistics['filteredMatches'] = len(filtered_matches)
+        print(f"Filtered to {len(filtered_matches)} top matches (topK={top_k} per tile-rotation-border)")
+
+    # Calibration του cost model με τους πραγματικούς χρόνους
+    _, elements, matches = cost_model.adjacency_units({**requested, **admission['applied'], 'includeMatrix': include_matrix})
+    cost_model.observe('adjacency', elements, timings['adjacency'])
+    cost_model.observe('matches', matches, timings.get('matches', 0.0))
+
+    return response
+
+
+@app.get("/api/store")
+async def get_store_status():
+    """
+    Size, entries and references of the shared feature/score store.
+    """
+    return {'status': 'success', **shared_store.statistics()}
+
+
+@app.delete("/api/cnn-basis/{basis_id}")
+async def delete_cnn_basis(basis_id: str):
+    """
+    Release a stored CNN PCA basis (bases are pinned in the store until deleted).
+    """
+    if not shared_store.delete(basis_id, 'cnnBasis'):
+        return {"status": "error", "message": f"Unknown cnnBasisId '{basis_id}'"}
+    return {'status': 'success', 'basisId': basis_id}
 
-    # Store all compatibility scores
-    all_matches = []
 
-    # Opposite borders (για rotation=0 case - τα borders που πρέπει να ταιριάζουν)
-    opposite_borders = {
-        'top': 'bottom',
-        'right': 'left',
-        'bottom': 'top',
-        'left': 'right'
+@app.get("/api/adjacency/{matrix_id}")
+async def get_adjacency_summary(matrix_id: str):
+    """
+    Summary (parameters and statistics) of a stored adjacency matrix.
+    """
+    result = get_adjacency_result(matrix_id)
+    if result is None:
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}' (expired or never computed)"}
+
+    return {
+        'status': 'success',
+        'matrixId': matrix_id,
+        'gridSize': result.grid_size,
+        'totalTiles': result.num_tiles,
+        'weights': result.weights,
+        'cnnLayer': result.cnn_layer,
+        'statistics': result.statistics()
     }
 
-    # Για κάθε tile A
-    for i, tileA in enumerate(tiles):
-        # Για κάθε rotation του A (use string keys)
-        for rotA in ['0', '90', '180', '270']:
-            # Για κάθε border του A
-            for borderA in ['top', 'right', 'bottom', 'left']:
-                # Παίρνουμε τα features του A με rotation rotA
-                borderA_data = {
-                    'histogram': tileA['rotationFeatures'][rotA]['borderHistograms'][borderA],
-                    'gabor': tileA['rotationFeatures'][rotA]['borderGaborFeatures'][borderA],
-                    'cnn': tileA['rotationFeatures'][rotA]['borderCnnFeatures'][borderA]
-                }
 
-                # Συγκρίνουμε με κάθε άλλο tile B
-                for j, tileB in enumerate(tiles):
-                    if i == j:
-                        continue  # Don't compare tile with itself
-
-                    # Για κάθε rotation του B (use string keys)
-                    for rotB in ['0', '90', '180', '270']:
-                        # Το opposite border που πρέπει να ταιριάξει
-                        borderB = opposite_borders[borderA]
-
-                        # Παίρνουμε τα features του B με rotation rotB
-                        borderB_data = {
-                            'histogram': tileB['rotationFeatures'][rotB]['borderHistograms'][borderB],
-                            'gabor': tileB['rotationFeatures'][rotB]['borderGaborFeatures'][borderB],
-                            'cnn': tileB['rotationFeatures'][rotB]['borderCnnFeatures'][borderB]
-                        }
-
-                        # Calculate compatibility
-                        scores = get_border_compatibility(
-                            borderA_data,
-                            borderB_data,
-                            weights,
-                            cnn_layer
-                        )
-
-                        match_entry = {
-                            'tileA': i,
-                            'rotationA': int(rotA),  # Convert string to int for frontend
-                            'borderA': borderA,
-                            'tileB': j,
-                            'rotationB': int(rotB),  # Convert string to int for frontend
-                            'borderB': borderB,
-                            'compatibilityScore': float(scores['combined']),
-                            'scores': {
-                                'color': float(scores['color']),
-                                'gabor': float(scores['gabor']),
-                                'cnn': float(scores['cnn'])
-                            }
-                        }
-
-                        all_matches.append(match_entry)
-
-    print(f"Total comparisons: {len(all_matches)} (with rotation-aware features)")
-
-    # Sort by compatibility score (descending)
-    all_matches.sort(key=lambda x: x['compatibilityScore'], reverse=True)
-
-    # Calculate statistics
-    scores_list = [m['compatibilityScore'] for m in all_matches]
-    best_match = all_matches[0] if all_matches else None
+@app.get("/api/adjacency/{matrix_id}/best-matches")
+async def get_adjacency_best_matches(matrix_id: str, tile: int, rotation: int = 0, border: str = 'right', k: int = 10):
+    """
+    Best K partners (tileB, rotationB) for one (tile, rotation, border), best first.
+    """
+    result = get_adjacency_result(matrix_id)
+    if result is None:
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}' (expired or never computed)"}
+
+    error = validate_border_query(tile, rotation, border, result.num_tiles)
+    if error:
+        return {"status": "error", "message": error}
+
+    return {
+        'status': 'success',
+        'tile': tile,
+        'rotation': rotation,
+        'border': border,
+        'matches': result.best_matches(tile, rotation, border, k)
+    }
 
-    # For each tile-rotation-border combination, keep only top K matches
-    filtered_matches = []
-    tile_rotation_border_counts = {}
 
-    for match in all_matches:
-        # Key: (tileA, rotationA, borderA)
-        trio_key = (match['tileA'], match['rotationA'], match['borderA'])
+@app.get("/api/adjacency/{matrix_id}/pair")
+async def get_adjacency_pair(matrix_id: str, tileA: int, rotationA: int, borderA: str, tileB: int, rotationB: int):
+    """
+    Score of one specific pair: tileA (rotationA) borderA against the opposite border of tileB (rotationB).
+    """
+    result = get_adjacency_result(matrix_id)
+    if result is None:
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}' (expired or never computed)"}
 
-        if trio_key not in tile_rotation_border_counts:
-            tile_rotation_border_counts[trio_key] = 0
+    error = (
+        validate_border_query(tileA, rotationA, borderA, result.num_tiles) or
+        validate_border_query(tileB, rotationB, OPPOSITE_BORDERS.get(borderA, borderA), result.num_tiles)
+    )
+    if error:
+        return {"status": "error", "message": error}
+    if tileA == tileB:
+        return {"status": "error", "message": "A tile is not compared with itself"}
+
+    return {'status': 'success', 'match': result.pair(tileA, rotationA, borderA, tileB, rotationB)}
+
+
+@app.get("/api/adjacency/{matrix_id}/ranking")
+async def get_adjacency_ranking(
+    matrix_id: str,
+    offset: int = 0,
+    limit: int = 100,
+    minScore: float = None,
+    maxScore: float = None
+):
+    """
+    Page of the global ranking of all border pairs (best first).
 
-        if tile_rotation_border_counts[trio_key] < top_k:
-            filtered_matches.append(match)
-            tile_rotation_border_counts[trio_key] += 1
+    minScore / maxScore restrict the ranking to a score range; 'total' is the
+    number of pairs in that range (e.g. limit=0 just counts pairs above a threshold).
+    """
+    result = get_adjacency_result(matrix_id)
+    if result is None:
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}' (expired or never computed)"}
 
-    print(f"Filtered to {len(filtered_matches)} top matches (topK={top_k} per tile-rotation-border)")
+    limit = min(limit, 1000)
+    total, matches = result.ranking_page(offset, limit, min_score=minScore, max_score=maxScore)
 
     return {
         'status': 'success',
-        'gridSize': grid_size,
-        'totalTiles': len(tiles),
-        'weights': weights,
-        'cnnLayer': cnn_layer,
-        'topK': top_k,
-        'adjacencyMatrix': filtered_matches,
-        'statistics': {
-            'totalComparisons': len(all_matches),
-            'filteredMatches': len(filtered_matches),
-            'averageCompatibility': float(np.mean(scores_list)),
-            'minCompatibility': float(np.min(scores_list)),
-            'maxCompatibility': float(np.max(scores_list)),
-            'stdCompatibility': float(np.std(scores_list)),
-            'bestMatch': best_match
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'matches': matches
+    }
+
+
+@app.get("/api/adjacency/{matrix_id}/tile-pairs")
+async def get_adjacency_tile_pairs(matrix_id: str):
+    """
+    Mean compatibility of every tile pair (totalTiles x totalTiles, null on the diagonal).
+    """
+    result = get_adjacency_result(matrix_id)
+    if result is None:
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}' (expired or never computed)"}
+
+    return {'status': 'success', 'totalTiles': result.num_tiles, 'scores': result.tile_pair_scores()}
+
+
+@app.get("/api/adjacency/{matrix_id}/top-matches")
+async def get_adjacency_top_matches(matrix_id: str, k: int = 10):
+    """
+    Top K matches of every (tile, rotation, border) - the "adjacencyMatrix" list of
+    /api/calculate-adjacency-matrix, for results computed with includeMatrix=false
+    (or downgraded to noMatrixInResponse by admission control).
+    """
+    result = get_adjacency_result(matrix_id)
+    if result is None:
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}' (expired or never computed)"}
+
+    matches = await asyncio.to_thread(result.top_k_matches, k)
+    return {'status': 'success', 'k': k, 'matches': matches}
+
+
+@app.delete("/api/adjacency/{matrix_id}")
+async def delete_adjacency_result(matrix_id: str):
+    """
+    Release a stored adjacency matrix.
+    """
+    if not shared_store.delete(matrix_id, 'adjacency'):
+        return {"status": "error", "message": f"Unknown matrixId '{matrix_id}'"}
+    return {'status': 'success', 'matrixId': matrix_id}
+
+
+# ============================================================================
+# IMAGE RECONSTRUCTION - LIVE SOLVER
+# ============================================================================
+
+class AnnealingSession:
+    """
+    Simulated annealing over a stored adjacency matrix, run in small chunks so
+    progress can be streamed and the schedule changed while it runs.
+
+    Same moves and acceptance rule as the frontend solver (swap two tiles or
+    re-rotate one, Metropolis acceptance, geometric cooling). The energy is
+    minus the sum of the right/bottom pair scores; since the full matrix is
+    available there is no "missing match" penalty, and each move only
+    re-scores the pairs around the touched positions.
+    """
+
+    def __init__(self, result, initial_temp=100.0, cooling_rate=0.95, iterations=1000, seed=None):
+        self.grid_size = result.grid_size
+        self.num_positions = self.grid_size * self.grid_size
+
+        combined = result.scores['combined']
+        self.right_scores = combined[:, :, BORDER_NAMES.index('right')]
+        self.bottom_scores = combined[:, :, BORDER_NAMES.index('bottom')]
+
+        self.random = random.Random(seed)
+        self.temperature = float(initial_temp)
+        self.cooling_rate = float(cooling_rate)
+        self.iterations = int(iterations)
+        self.iteration = 0
+        self.stop_requested = False
+
+        # Random initial configuration: position -> tile index / rotation index
+        self.tiles = list(range(result.num_tiles))
+        self.random.shuffle(self.tiles)
+        self.rotations = [self.random.randrange(len(ROTATION_ANGLES)) for _ in self.tiles]
+
+        self.current_energy = self.total_energy()
+        self.best_energy = self.current_energy
+        self.best_tiles = list(self.tiles)
+        self.best_rotations = list(self.rotations)
+        self.best_changed = True
+
+    @property
+    def finished(self):
+        return self.stop_requested or self.iteration >= self.iterations
+
+    def pair_score(self, position, neighbor, scores):
+        return float(scores[
+            self.tiles[position], self.rotations[position],
+            self.tiles[neighbor], self.rotations[neighbor]
+        ])
+
+    def total_energy(self):
+        tiles = np.array(self.tiles).reshape(self.grid_size, self.grid_size)
+        rotations = np.array(self.rotations).reshape(self.grid_size, self.grid_size)
+        right = self.right_scores[tiles[:, :-1], rotations[:, :-1], tiles[:, 1:], rotations[:, 1:]]
+        bottom = self.bottom_scores[tiles[:-1], rotations[:-1], tiles[1:], rotations[1:]]
+        return -float(right.sum() + bottom.sum())
+
+    def local_energy(self, positions):
+        """Energy of the pairs that touch any of the positions (each pair once)."""
+        edges = set()
+        for position in positions:
+            row, col = divmod(position, self.grid_size)
+            if col < self.grid_size - 1:
+                edges.add((position, position + 1, 'right'))
+            if col > 0:
+                edges.add((position - 1, position, 'right'))
+            if row < self.grid_size - 1:
+                edges.add((position, position + self.grid_size, 'bottom'))
+            if row > 0:
+                edges.add((position - self.grid_size, position, 'bottom'))
+
+        energy = 0.0
+        for first, second, direction in edges:
+            scores = self.right_scores if direction == 'right' else self.bottom_scores
+            energy -= self.pair_score(first, second, scores)
+        return energy
+
+    def run(self, count):
+        """Run up to `count` iterations (stops early on stop / iteration budget)."""
+        for _ in range(count):
+            if self.finished:
+                return
+
+            if self.random.random() < 0.5:
+                # Swap two tiles
+                first = self.random.randrange(self.num_positions)
+                second = self.random.randrange(self.num_positions)
+                touched = (first, second)
+                before = self.local_energy(touched)
+                self.tiles[first], self.tiles[second] = self.tiles[second], self.tiles[first]
+                self.rotations[first], self.rotations[second] = self.rotations[second], self.rotations[first]
+                delta = self.local_energy(touched) - before
+                rejected = not self.accept(delta)
+                if rejected:
+                    self.tiles[first], self.tiles[second] = self.tiles[second], self.tiles[first]
+                    self.rotations[first], self.rotations[second] = self.rotations[second], self.rotations[first]
+            else:
+                # Rotate a random tile
+                position = self.random.randrange(self.num_positions)
+                touched = (position,)
+                before = self.local_energy(touched)
+                old_rotation = self.rotations[position]
+                self.rotations[position] = self.random.randrange(len(ROTATION_ANGLES))
+                delta = self.local_energy(touched) - before
+                rejected = not self.accept(delta)
+                if rejected:
+                    self.rotations[position] = old_rotation
+
+            if not rejected:
+                self.current_energy += delta
+                if self.current_energy < self.best_energy:
+                    self.best_energy = self.current_energy
+                    self.best_tiles = list(self.tiles)
+                    self.best_rotations = list(self.rotations)
+                    self.best_changed = True
+
+            # Cool down
+            self.temperature *= self.cooling_rate
+            self.iteration += 1
+
+    def accept(self, delta):
+        if delta < 0:
+            return True
+        if self.temperature <= 0:
+            return False
+        return self.random.random() < math.exp(-delta / self.temperature)
+
+    def update_schedule(self, message):
+        """
+        Change the schedule of a running session (any subset of the keys).
+
+        All values are converted before any is applied, so an invalid
+        message (ValueError / TypeError) leaves the schedule unchanged.
+        """
+        temperature = float(message['temperature']) if 'temperature' in message else self.temperature
+        cooling_rate = float(message['coolingRate']) if 'coolingRate' in message else self.cooling_rate
+        iterations = int(message['iterations']) if 'iterations' in message else self.iterations
+        self.temperature, self.cooling_rate, self.iterations = temperature, cooling_rate, iterations
+
+    def grid_json(self, tiles, rotations):
+        """Grid in the frontend format: rows of {tileIndex, rotation}."""
+        return [
+            [
+                {'tileIndex': tiles[row * self.grid_size + col], 'rotation': ROTATION_ANGLES[rotations[row * self.grid_size + col]]}
+                for col in range(self.grid_size)
+            ]
+            for row in range(self.grid_size)
+        ]
+
+    def progress(self):
+        """Progress message; includes the best grid only when it improved since the last one."""
+        message = {
+            'type': 'progress',
+            'iteration': self.iteration,
+            'iterations': self.iterations,
+            'temperature': self.temperature,
+            'coolingRate': self.cooling_rate,
+            'currentEnergy': self.current_energy,
+            'bestEnergy': self.best_energy
         }
-    }
\ No newline at end of file
+        if self.best_changed:
+            message['bestGrid'] = self.grid_json(self.best_tiles, self.best_rotations)
+            self.best_changed = False
+        return message
+
+
+@app.websocket("/api/ws/solve")
+async def solve_websocket(websocket: WebSocket):
+    """
+    Live simulated annealing over a stored adjacency matrix.
+
+    Client -> server (JSON):
+        {"type": "start", "matrixId": str, "initialTemp": float, "coolingRate": float,
+         "iterations": int, "progressInterval": int (iterations per progress message), "seed": int}
+        {"type": "update", "temperature": float, "coolingRate": float, "iterations": int}  (any subset)
+        {"type": "stop"}
+
+    Server -> client (JSON):
+        {"type": "progress", "iteration", "iterations", "temperature", "coolingRate",
+         "currentEnergy", "bestEnergy", "bestGrid" (only when the best grid improved)}
+        {"type": "done", "reason": "completed" | "stopped", "iteration", "bestEnergy", "bestGrid"}
+        {"type": "error", "message": str}
+    """
+    await websocket.accept()
+
+    async def send_error(message):
+        await websocket.send_json({'type': 'error', 'message': message})
+
+    try:
+        start = await websocket.receive_json()
+    except WebSocketDisconnect:
+        return
+    except json.JSONDecodeError as error:
+        await send_error(f'Invalid JSON in start message: {error}')
+        await websocket.close()
+        return
+    if not isinstance(start, dict):
+        await send_error('The start message must be a JSON object')
+        await websocket.close()
+        return
+
+    result = get_adjacency_result(start.get('matrixId'))
+    if result is None:
+        await websocket.send_json({'type': 'error', 'message': f"Unknown matrixId '{start.get('matrixId')}' (expired or never computed)"})
+        await websocket.close()
+        return
+    if result.num_tiles != result.grid_size * result.grid_size:
+        await websocket.send_json({'type': 'error', 'message': 'The live solver needs a full grid (totalTiles = gridSize²)'})
+        await websocket.close()
+        return
+
+    try:
+        session = AnnealingSession(
+            result,
+            initial_temp=start.get('initialTemp', 100.0),
+            cooling_rate=start.get('coolingRate', 0.95),
+            iterations=start.get('iterations', 1000),
+            seed=start.get('seed')
+        )
+        progress_interval = max(1, int(start.get('progressInterval', 100)))
+    except (ValueError, TypeError) as error:
+        await send_error(f'Invalid start parameters: {error}')
+        await websocket.close()
+        return
+    disconnected = False
+
+    async def receive_commands():
+        nonlocal disconnected
+        while True:
+            try:
+                message = await websocket.receive_json()
+                if not isinstance(message, dict):
+                    raise ValueError('commands must be JSON objects')
+                if message.get('type') == 'stop':
+                    session.stop_requested = True
+                elif message.get('type') == 'update':
+                    session.update_schedule(message)
+            except WebSocketDisconnect:
+                disconnected = True
+                session.stop_requested = True
+                return
+            except (ValueError, TypeError) as error:
+                # Ένα λάθος command δεν σταματά το session - το επόμενο "stop" ισχύει κανονικά
+                # (json.JSONDecodeError είναι ValueError)
+                await send_error(f'Invalid command: {error}')
+
+    # Το matrix δεν γίνεται evict από το shared store όσο τρέχει το session. Το retain
+    # γίνεται μόνο αφού το session είναι έγκυρο και μέσα στο try, ώστε το finally να το
+    # αποδεσμεύει πάντα
+    matrix_id = start['matrixId']
+    retained = False
+    receiver = asyncio.create_task(receive_commands())
+    try:
+        retained = shared_store.retain(matrix_id)
+        while not session.finished:
+            # The annealing chunk runs in a worker thread so commands are still received
+            await asyncio.to_thread(session.run, progress_interval)
+            if disconnected:
+                return
+            await websocket.send_json(session.progress())
+
+        await websocket.send_json({
+            'type': 'done',
+            'reason': 'stopped' if session.stop_requested else 'completed',
+            'iteration': session.iteration,
+            'bestEnergy': session.best_energy,
+            'bestGrid': session.grid_json(session.best_tiles, session.best_rotations)
+        })
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if retained:
+            shared_store.release(matrix_id)
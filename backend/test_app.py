@@ -0,0 +1,338 @@
+"""
+Tests του backend: unit tests των features/metrics και end-to-end tests των
+endpoints (extraction -> adjacency matrix -> query API -> live solver).
+
+Τρέχουν με `python -m pytest` από τον φάκελο backend. Τα end-to-end tests
+χρειάζονται το tensorflow και τα MobileNetV2 weights (αλλιώς γίνονται skip).
+"""
+import json
+import os
+from io import BytesIO
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from fastapi.testclient import TestClient
+
+# Ξεχωριστό shared store για τα tests (πριν το import του app) - διαγράφεται στο τέλος
+TEST_STORE_DIR = tempfile.mkdtemp(prefix='analyshEikonas-test-store-')
+os.environ['SHARED_STORE_DIR'] = TEST_STORE_DIR
+
+import app as backend  # noqa: E402
+
+
+GRID_SIZE = 2
+BORDER_INDEX = {name: index for index, name in enumerate(backend.BORDER_NAMES)}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def test_store():
+    yield
+    shutil.rmtree(TEST_STORE_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    pytest.importorskip('tensorflow')
+    # Τα border strips πάνε σε temp φάκελο - όχι στο tempPhotos του developer
+    backend.TEMP_PHOTOS_DIR = tmp_path_factory.mktemp('tempPhotos')
+    return TestClient(backend.app)
+
+
+def make_test_image(size=64):
+    """PNG με gradients ώστε κάθε tile να έχει διαφορετικά borders."""
+    ys, xs = np.mgrid[0:size, 0:size]
+    image = np.stack([xs * 4 % 256, ys * 4 % 256, (xs + ys) * 2 % 256], axis=-1).astype(np.uint8)
+    ok, encoded = cv2.imencode('.png', image)
+    assert ok
+    return encoded.tobytes()
+
+
+def calculate_histograms(client, **fields):
+    tiles = [
+        {'sourceIndex': index, 'destPosition': index, 'rotation': 0}
+        for index in range(GRID_SIZE * GRID_SIZE)
+    ]
+    data = {
+        'gridSize': GRID_SIZE,
+        'borderWidth': 2,
+        'bins': 8,
+        'gaborFeatures': 'false',
+        'cnnLayers': 'block_1_expand_relu',
+        'tiles': json.dumps(tiles)
+    }
+    data.update(fields)
+    response = client.post(
+        '/api/calculate-histograms',
+        data=data,
+        files={'image': ('image.png', make_test_image(), 'image/png')}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_extract_adjacency_and_solve_pipeline(client):
+    histograms = calculate_histograms(client, cnnDim='8', cnnPrecision='float16')
+    assert histograms['status'] == 'success', histograms
+    assert histograms['admission']['decision'] in ('accepted', 'queued', 'downgraded')
+    assert histograms['featureSetId']
+    assert len(histograms['results']) == GRID_SIZE * GRID_SIZE
+    assert histograms['cnnCompression']['layers']['block_1_expand_relu']['dim'] == 8
+    for stage in ('decode', 'histogram', 'cnn', 'io'):
+        assert stage in histograms['timings']
+
+    # Μόνο το featureSetId - τα features βρίσκονται στο shared store
+    response = client.post('/api/calculate-adjacency-matrix', json={
+        'featureSetId': histograms['featureSetId'],
+        'weights': {'color': 0.4, 'cnn': 0.3, 'pixel': 0.3},
+        'cnnLayer': 'block_1_expand_relu',
+        'includeMatrix': False
+    })
+    adjacency = response.json()
+    assert adjacency['status'] == 'success', adjacency
+    assert 'adjacencyMatrix' not in adjacency
+    matrix_id = adjacency['matrixId']
+
+    matches = client.get(
+        f'/api/adjacency/{matrix_id}/best-matches',
+        params={'tile': 0, 'rotation': 0, 'border': 'right', 'k': 3}
+    ).json()
+    assert matches['status'] == 'success'
+    assert len(matches['matches']) == 3
+    scores = [match['compatibilityScore'] for match in matches['matches']]
+    assert scores == sorted(scores, reverse=True)
+
+    tile_pairs = client.get(f'/api/adjacency/{matrix_id}/tile-pairs').json()
+    assert tile_pairs['status'] == 'success'
+    assert len(tile_pairs['scores']) == GRID_SIZE * GRID_SIZE
+    assert all(tile_pairs['scores'][tile][tile] is None for tile in range(GRID_SIZE * GRID_SIZE))
+
+    # Η λίστα του response διαθέσιμη και εκ των υστέρων
+    top_matches = client.get(f'/api/adjacency/{matrix_id}/top-matches', params={'k': 2}).json()
+    assert top_matches['status'] == 'success'
+    assert len(top_matches['matches']) == GRID_SIZE * GRID_SIZE * 16 * 2
+
+    with client.websocket_connect('/api/ws/solve') as websocket:
+        websocket.send_json({'type': 'start', 'matrixId': matrix_id, 'iterations': 50, 'seed': 1})
+        message = websocket.receive_json()
+        while message['type'] == 'progress':
+            message = websocket.receive_json()
+    assert message['type'] == 'done'
+    assert message['iteration'] == 50
+    placed = [cell['tileIndex'] for row in message['bestGrid'] for cell in row]
+    assert sorted(placed) == list(range(GRID_SIZE * GRID_SIZE))
+
+
+def test_adjacency_from_histogram_payload(client):
+    histograms = calculate_histograms(client, cnnFeatures='false')
+    assert histograms['status'] == 'success', histograms
+
+    response = client.post('/api/calculate-adjacency-matrix', json={
+        'histogramData': {key: value for key, value in histograms.items() if key != 'featureSetId'},
+        'weights': {'color': 0.5, 'pixel': 0.5},
+        'topK': 2
+    })
+    adjacency = response.json()
+    assert adjacency['status'] == 'success', adjacency
+    # 4 tiles x 4 rotations x 4 borders, topK = 2
+    assert len(adjacency['adjacencyMatrix']) == GRID_SIZE * GRID_SIZE * 16 * 2
+
+
+def test_solver_rejects_invalid_messages(client):
+    histograms = calculate_histograms(client, cnnFeatures='false')
+    adjacency = client.post('/api/calculate-adjacency-matrix', json={
+        'featureSetId': histograms['featureSetId'],
+        'weights': {'color': 0.5, 'pixel': 0.5},
+        'includeMatrix': False
+    }).json()
+    matrix_id = adjacency['matrixId']
+
+    with client.websocket_connect('/api/ws/solve') as websocket:
+        websocket.send_text('not json')
+        assert websocket.receive_json()['type'] == 'error'
+
+    with client.websocket_connect('/api/ws/solve') as websocket:
+        websocket.send_json({'type': 'start', 'matrixId': matrix_id, 'initialTemp': None})
+        assert websocket.receive_json()['type'] == 'error'
+    # Ένα session που απορρίφθηκε δεν κρατά reference στο matrix
+    assert backend.shared_store.statistics()['referenced'] == 0
+
+    # Ένα λάθος update δεν σταματά το session και το stop ισχύει κανονικά
+    with client.websocket_connect('/api/ws/solve') as websocket:
+        websocket.send_json({
+            'type': 'start', 'matrixId': matrix_id, 'iterations': 10 ** 7, 'progressInterval': 10, 'seed': 1
+        })
+        websocket.send_json({'type': 'update', 'coolingRate': None})
+        websocket.send_json({'type': 'stop'})
+        types = []
+        message = websocket.receive_json()
+        while message['type'] != 'done':
+            types.append(message['type'])
+            message = websocket.receive_json()
+    assert 'error' in types
+    assert message['iteration'] < 10 ** 7
+
+
+def test_shared_store_keeps_new_entry_and_rejects_oversized(tmp_path):
+    store = backend.SharedTensorStore(tmp_path, max_bytes=1000, max_entries=8)
+    old_key = store.put('features', {'x': np.zeros(100, dtype=np.float32)}, {})
+    assert store.retain(old_key)
+    # Το παλιό entry είναι referenced: το store μένει πάνω από το budget αλλά το νέο
+    # entry δεν γίνεται evict από το ίδιο του το put
+    new_key = store.put('features', {'x': np.ones(200, dtype=np.float32)}, {})
+    assert store.get(old_key, 'features') is not None
+    assert store.get(new_key, 'features') is not None
+
+    # Μεγαλύτερο από όλο το budget: δεν αποθηκεύεται και δεν διώχνει τα υπόλοιπα
+    store.release(old_key)
+    assert store.put('features', {'x': np.zeros(1000, dtype=np.float32)}, {}) is None
+    assert store.statistics()['entries'] == 2
+    assert len(list(tmp_path.glob('*.npy'))) == 2
+
+
+def test_cnn_basis_fixes_the_embedding_dim(client):
+    # Χωρίς saveCnnBasis το basis ανά εικόνα δεν αποθηκεύεται
+    assert calculate_histograms(client, cnnDim='4')['cnnCompression']['basisId'] is None
+
+    first = calculate_histograms(client, cnnDim='4', cnnPrecision='float16', saveCnnBasis='true')
+    basis_id = first['cnnCompression']['basisId']
+    assert basis_id
+
+    # cnnDim = 0 υιοθετεί τη διάσταση του basis
+    reused = calculate_histograms(client, cnnBasisId=basis_id)
+    assert reused['status'] == 'success', reused
+    assert reused['cnnCompression']['dim'] == 4
+    assert reused['cnnCompression']['basisReused'] == ['block_1_expand_relu']
+    assert reused['cnnCompression']['layers']['block_1_expand_relu']['dim'] == 4
+
+    mismatch = calculate_histograms(client, cnnBasisId=basis_id, cnnDim='8')
+    assert mismatch['status'] == 'error'
+
+
+def test_shared_store_never_evicts_pinned_entries(tmp_path):
+    store = backend.SharedTensorStore(tmp_path, max_bytes=10 ** 6, max_entries=2)
+    basis_key = store.put('cnnBasis', {'layer': np.zeros((4, 8), dtype=np.float32)}, {'dim': 4}, pinned=True)
+    for _ in range(3):
+        store.put('features', {'x': np.zeros(10, dtype=np.float32)}, {})
+    assert store.get(basis_key, 'cnnBasis') is not None
+    assert store.statistics()['pinned'] == 1
+
+    # Τα pinned entries δεν μετράνε στο max_entries: δύο απλά entries χωράνε μαζί τους
+    first = store.put('features', {'x': np.zeros(10, dtype=np.float32)}, {})
+    second = store.put('adjacency', {'x': np.zeros(10, dtype=np.float32)}, {})
+    assert store.get(first, 'features') is not None
+    assert store.get(second, 'adjacency') is not None
+    assert store.delete(basis_key, 'cnnBasis')
+    assert store.get(basis_key, 'cnnBasis') is None
+
+
+def make_smooth_image(size=96):
+    """Ομαλή (αλλά όχι γραμμική) εικόνα - κάθε tile συνεχίζει ομαλά στους γείτονές του."""
+    ys, xs = np.mgrid[0:size, 0:size] / size
+    channels = [
+        128 + 100 * np.sin(2.0 * np.pi * xs + 1.3 * ys),
+        128 + 100 * np.cos(3.0 * np.pi * ys * xs + 0.5),
+        128 + 100 * np.sin(1.7 * np.pi * (xs - ys) ** 2)
+    ]
+    return np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('rotation, rotate_code', [
+    (90, cv2.ROTATE_90_CLOCKWISE),
+    (180, cv2.ROTATE_180),
+    (270, cv2.ROTATE_90_COUNTERCLOCKWISE)
+])
+def test_rotated_boundary_profiles_match_rotated_tile(rotation, rotate_code):
+    tile = np.random.default_rng(rotation).integers(0, 256, (12, 12, 3), dtype=np.uint8)
+    expected = backend.extract_boundary_profiles(cv2.rotate(tile, rotate_code))
+    rotated = backend.rotate_boundary_profiles(backend.extract_boundary_profiles(tile), rotation)
+    np.testing.assert_array_equal(rotated, expected)
+
+
+def test_boundary_dissimilarity_ranks_true_neighbours_first():
+    grid = 3
+    tiles = backend.tile_grid_view(make_smooth_image(), grid).reshape(grid * grid, 32, 32, 3)
+    profiles = np.stack([backend.extract_boundary_profiles(tile) for tile in tiles])
+    right, bottom, top, left = (BORDER_INDEX[name] for name in ('right', 'bottom', 'top', 'left'))
+
+    for tile in range(grid * grid):
+        row, col = divmod(tile, grid)
+        if col < grid - 1:
+            distances = backend.boundary_dissimilarity(profiles[tile:tile + 1, right], profiles[:, left])[0]
+            distances[tile] = np.inf
+            assert np.argmin(distances) == tile + 1
+        if row < grid - 1:
+            distances = backend.boundary_dissimilarity(profiles[tile:tile + 1, bottom], profiles[:, top])[0]
+            distances[tile] = np.inf
+            assert np.argmin(distances) == tile + grid
+
+
+def calc_hist_reference(region, bins):
+    """Το αρχικό cv2.calcHist histogram (normalized, RGB σειρά) ως reference."""
+    histograms = [cv2.calcHist([region], [channel], None, [bins], [0, 256]).ravel() for channel in (2, 1, 0)]
+    return np.array([histogram / (histogram.sum() + 1e-7) for histogram in histograms])
+
+
+@pytest.mark.parametrize('bins', [7, 10, 16, 256])
+def test_tile_histograms_match_calc_hist(bins):
+    grid, border_width = 2, 3
+    image = np.random.default_rng(bins).integers(0, 256, (40, 40, 3), dtype=np.uint8)
+    tile_histograms, border_histograms = backend.calculate_tile_histograms(
+        image, [3, 0, 2], grid, border_width, bins=bins
+    )
+    tiles = backend.tile_grid_view(image, grid)
+
+    rotate_codes = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+    for position, source_index in enumerate([3, 0, 2]):
+        tile = np.ascontiguousarray(tiles[source_index // grid, source_index % grid])
+        np.testing.assert_allclose(tile_histograms[position], calc_hist_reference(tile, bins), atol=1e-6)
+
+        # Τα borders κάθε rotation = borders του πραγματικά περιστραμμένου tile
+        for rotation_index, rotation in enumerate(backend.ROTATION_ANGLES):
+            rotated = cv2.rotate(tile, rotate_codes[rotation]) if rotation else tile
+            strips = backend.extract_border_strips(rotated, border_width)
+            for border_index, border in enumerate(backend.BORDER_NAMES):
+                np.testing.assert_allclose(
+                    border_histograms[position, rotation_index, border_index],
+                    calc_hist_reference(np.ascontiguousarray(strips[border]), bins),
+                    atol=1e-6
+                )
+
+
+def test_reduced_decode_follows_exif_orientation():
+    # Αποθηκευμένο 160x120, EXIF orientation 6 -> εμφανίζεται 120x160 (όπως το decode του cv2)
+    stored = np.zeros((120, 160, 3), dtype=np.uint8)
+    stored[:, :80] = 255
+    image = Image.fromarray(stored)
+    exif = image.getexif()
+    exif[backend.EXIF_ORIENTATION_TAG] = 6
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    contents = buffer.getvalue()
+
+    assert backend.read_image_size(contents) == (120, 160)
+    full, _ = backend.decode_image(contents, 2)
+    reduced, scale = backend.decode_image(contents, 2, max_tile_size=20)
+    assert full.shape[:2] == (160, 120)
+    assert reduced.shape[:2] == (40, 30)
+    assert scale == (0.25, 0.25)
+
+
+def test_adjacency_matrix_too_large_for_the_store(client, monkeypatch):
+    histograms = calculate_histograms(client, cnnFeatures='false')
+    monkeypatch.setattr(backend.shared_store, 'max_bytes', 1)
+
+    adjacency = client.post('/api/calculate-adjacency-matrix', json={
+        'histogramData': histograms,
+        'weights': {'color': 0.5, 'pixel': 0.5},
+        'topK': 2,
+        'includeMatrix': False
+    }).json()
+    # Το αποτέλεσμα επιστρέφεται από τη μνήμη, με τη λίστα αφού δεν υπάρχει query API
+    assert adjacency['status'] == 'success', adjacency
+    assert adjacency['matrixId'] is None
+    assert len(adjacency['adjacencyMatrix']) == GRID_SIZE * GRID_SIZE * 16 * 2
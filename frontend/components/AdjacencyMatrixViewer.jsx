@@ -1,4 +1,4 @@
-import { useContext, useState } from "react"
+import { useContext, useState, useEffect } from "react"
 import { AppContext } from "../src/App"
 
 export default function AdjacencyMatrixViewer() {
@@ -7,10 +7,15 @@ export default function AdjacencyMatrixViewer() {
     // State
     const [adjacencyData, setAdjacencyData] = useState(null)
     const [loading, setLoading] = useState(false)
-    const [weights, setWeights] = useState({ color: 0.4, gabor: 0.3, cnn: 0.3 })
+    const [weights, setWeights] = useState({ color: 0.4, gabor: 0.3, cnn: 0.3, pixel: 0 })
     const [cnnLayer, setCnnLayer] = useState('block_6_expand_relu')
     const [topK, setTopK] = useState(20)
     const [selectedTile, setSelectedTile] = useState(0)
+    const [selectedRotation, setSelectedRotation] = useState(0)
+    const [tileMatches, setTileMatches] = useState(null) // Best matches από το backend query API
+    const [matrixError, setMatrixError] = useState(null) // Αποτυχία φόρτωσης της λίστας matches
+    const [tilePairs, setTilePairs] = useState(null) // Μέσο score ανά ζευγάρι tiles για το heatmap
+    const [tilePairsError, setTilePairsError] = useState(null)
     const [viewMode, setViewMode] = useState('statistics') // 'statistics', 'matches', 'heatmap', 'reconstruction'
 
     const calculateAdjacencyMatrix = async () => {
@@ -29,7 +34,9 @@ export default function AdjacencyMatrixViewer() {
                     histogramData: histogramData,
                     weights: weights,
                     cnnLayer: cnnLayer,
-                    topK: topK
+                    topK: topK,
+                    // Η λίστα των matches μένει στο backend - τα views ρωτάνε το query API
+                    includeMatrix: false
                 })
             })
 
@@ -39,7 +46,9 @@ export default function AdjacencyMatrixViewer() {
                 setAdjacencyData(data) // Local state for this component
                 setContextAdjacencyData(data) // Save to context for ImageReconstruction component
                 console.log('Adjacency Matrix calculated:', data)
-                alert(`Success! Calculated ${data.statistics.totalComparisons} comparisons, filtered to ${data.statistics.filteredMatches} top matches.`)
+                alert(data.matrixId
+                    ? `Success! Calculated ${data.statistics.totalComparisons} comparisons (top ${data.topK} matches per tile-rotation-border available through the query API).`
+                    : `Calculated ${data.statistics.totalComparisons} comparisons. ${data.message}`)
             } else {
                 console.error('Backend error:', data)
                 alert('Error calculating adjacency matrix')
@@ -52,6 +61,94 @@ export default function AdjacencyMatrixViewer() {
         }
     }
 
+    // Best matches του επιλεγμένου tile/rotation από το backend (όχι client-side filter)
+    useEffect(() => {
+        if (viewMode !== 'matches' || !adjacencyData?.matrixId) return
+
+        const fetchMatches = async () => {
+            try {
+                const borderMatches = {}
+                for (const border of ['top', 'right', 'bottom', 'left']) {
+                    const params = new URLSearchParams({
+                        tile: selectedTile,
+                        rotation: selectedRotation,
+                        border: border,
+                        k: adjacencyData.topK
+                    })
+                    const response = await fetch(`/api/adjacency/${adjacencyData.matrixId}/best-matches?${params}`)
+                    const data = await response.json()
+                    if (data.status !== 'success') {
+                        console.error('Backend error:', data)
+                        setTileMatches(null)
+                        return
+                    }
+                    borderMatches[border] = data.matches
+                }
+                setTileMatches(borderMatches)
+            } catch (error) {
+                console.error('Network error:', error)
+                setTileMatches(null)
+            }
+        }
+
+        fetchMatches()
+    }, [viewMode, adjacencyData, selectedTile, selectedRotation])
+
+    // Heatmap: totalTiles x totalTiles μέσα scores από το backend αντί για τη λίστα των matches
+    useEffect(() => {
+        if (viewMode !== 'heatmap' || !adjacencyData?.matrixId) return
+        if (tilePairs?.matrixId === adjacencyData.matrixId) return
+
+        const fetchTilePairs = async () => {
+            setTilePairsError(null)
+            try {
+                const response = await fetch(`/api/adjacency/${adjacencyData.matrixId}/tile-pairs`)
+                const data = await response.json()
+                if (data.status !== 'success') {
+                    console.error('Backend error:', data)
+                    setTilePairsError(data.message)
+                    return
+                }
+                setTilePairs({ matrixId: adjacencyData.matrixId, scores: data.scores })
+            } catch (error) {
+                console.error('Network error:', error)
+                setTilePairsError(error.message)
+            }
+        }
+
+        fetchTilePairs()
+    }, [viewMode, adjacencyData, tilePairs])
+
+    // Το reconstruction δουλεύει πάνω στη λίστα των top matches. Αν το response δεν την
+    // περιέχει (includeMatrix=false ή downgrade "noMatrixInResponse" από το admission
+    // control) τη φέρνουμε από το query API
+    useEffect(() => {
+        if (viewMode !== 'reconstruction') return
+        if (!adjacencyData?.matrixId || adjacencyData.adjacencyMatrix) return
+
+        const fetchTopMatches = async () => {
+            setMatrixError(null)
+            try {
+                const params = new URLSearchParams({ k: adjacencyData.topK })
+                const response = await fetch(`/api/adjacency/${adjacencyData.matrixId}/top-matches?${params}`)
+                const data = await response.json()
+                if (data.status !== 'success') {
+                    console.error('Backend error:', data)
+                    setMatrixError(data.message)
+                    return
+                }
+                const withMatrix = { ...adjacencyData, adjacencyMatrix: data.matches }
+                setAdjacencyData(withMatrix)
+                setContextAdjacencyData(withMatrix)
+            } catch (error) {
+                console.error('Network error:', error)
+                setMatrixError(error.message)
+            }
+        }
+
+        fetchTopMatches()
+    }, [viewMode, adjacencyData])
+
     const handleWeightChange = (metric, value) => {
         const newWeights = { ...weights, [metric]: parseFloat(value) }
         setWeights(newWeights)
@@ -123,8 +220,21 @@ export default function AdjacencyMatrixViewer() {
                         />
                     </label>
 
+                    <label style={{ display: 'block', marginBottom: '8px' }}>
+                        Pixel (Boundary) Weight: {weights.pixel.toFixed(2)}
+                        <input
+                            type="range"
+                            min="0"
+                            max="1"
+                            step="0.05"
+                            value={weights.pixel}
+                            onChange={(e) => handleWeightChange('pixel', e.target.value)}
+                            style={{ width: '100%' }}
+                        />
+                    </label>
+
                     <p style={{ fontSize: '12px', color: '#666' }}>
-                        Sum: {(weights.color + weights.gabor + weights.cnn).toFixed(2)}
+                        Sum: {(weights.color + weights.gabor + weights.cnn + weights.pixel).toFixed(2)}
                     </p>
                 </div>
 
@@ -266,7 +376,7 @@ export default function AdjacencyMatrixViewer() {
                                     <strong>Total Comparisons:</strong> {adjacencyData.statistics.totalComparisons}
                                 </div>
                                 <div style={{ padding: '10px', backgroundColor: '#f0f0f0', borderRadius: '5px' }}>
-                                    <strong>Filtered Matches:</strong> {adjacencyData.statistics.filteredMatches}
+                                    <strong>Filtered Matches:</strong> {adjacencyData.adjacencyMatrix ? adjacencyData.adjacencyMatrix.length : `top ${adjacencyData.topK} per tile-rotation-border (query API)`}
                                 </div>
                                 <div style={{ padding: '10px', backgroundColor: '#e3f2fd', borderRadius: '5px' }}>
                                     <strong>Avg Compatibility:</strong> {adjacencyData.statistics.averageCompatibility.toFixed(4)}
@@ -299,14 +409,15 @@ export default function AdjacencyMatrixViewer() {
                                     <p style={{ fontSize: '12px' }}>
                                         Color: {adjacencyData.statistics.bestMatch.scores.color.toFixed(4)} |
                                         Gabor: {adjacencyData.statistics.bestMatch.scores.gabor.toFixed(4)} |
-                                        CNN: {adjacencyData.statistics.bestMatch.scores.cnn.toFixed(4)}
+                                        CNN: {adjacencyData.statistics.bestMatch.scores.cnn.toFixed(4)} |
+                                        Pixel: {(adjacencyData.statistics.bestMatch.scores.pixel ?? 0).toFixed(4)}
                                     </p>
                                 </div>
                             )}
 
                             <div style={{ marginTop: '20px', padding: '10px', backgroundColor: '#fffacd', borderRadius: '5px' }}>
                                 <p style={{ margin: 0, fontSize: '13px' }}>
-                                    <strong>Weights used:</strong> Color: {adjacencyData.weights.color} | Gabor: {adjacencyData.weights.gabor} | CNN: {adjacencyData.weights.cnn}
+                                    <strong>Weights used:</strong> Color: {adjacencyData.weights.color} | Gabor: {adjacencyData.weights.gabor} | CNN: {adjacencyData.weights.cnn} | Pixel: {adjacencyData.weights.pixel ?? 0}
                                     <br />
                                     <strong>CNN Layer:</strong> {adjacencyData.cnnLayer}
                                 </p>
@@ -333,13 +444,27 @@ export default function AdjacencyMatrixViewer() {
                                         ))}
                                     </select>
                                 </label>
+                                <label style={{ marginLeft: '20px' }}>
+                                    <strong>Rotation:</strong>
+                                    <select
+                                        value={selectedRotation}
+                                        onChange={(e) => setSelectedRotation(parseInt(e.target.value))}
+                                        style={{ marginLeft: '10px', padding: '8px', cursor: 'pointer' }}
+                                    >
+                                        {[0, 90, 180, 270].map(rotation => (
+                                            <option key={rotation} value={rotation}>{rotation}°</option>
+                                        ))}
+                                    </select>
+                                </label>
                             </div>
 
                             {/* Matches for selected tile */}
                             {['top', 'right', 'bottom', 'left'].map(border => {
-                                const matches = adjacencyData.adjacencyMatrix.filter(
-                                    m => m.tileA === selectedTile && m.borderA === border
-                                )
+                                const matches = tileMatches
+                                    ? (tileMatches[border] || [])
+                                    : (adjacencyData.adjacencyMatrix || []).filter(
+                                        m => m.tileA === selectedTile && m.rotationA === selectedRotation && m.borderA === border
+                                    )
 
                                 return (
                                     <div key={border} style={{ marginBottom: '30px' }}>
@@ -359,6 +484,7 @@ export default function AdjacencyMatrixViewer() {
                                                         <th style={{ padding: '8px', border: '1px solid #ddd' }}>Color</th>
                                                         <th style={{ padding: '8px', border: '1px solid #ddd' }}>Gabor</th>
                                                         <th style={{ padding: '8px', border: '1px solid #ddd' }}>CNN</th>
+                                                        <th style={{ padding: '8px', border: '1px solid #ddd' }}>Pixel</th>
                                                     </tr>
                                                 </thead>
                                                 <tbody>
@@ -367,13 +493,14 @@ export default function AdjacencyMatrixViewer() {
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{idx + 1}</td>
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center', fontWeight: 'bold' }}>{match.tileB}</td>
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{match.borderB}</td>
-                                                            <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{match.rotation}°</td>
+                                                            <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{match.rotationB}°</td>
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center', fontWeight: 'bold', color: '#9C27B0' }}>
                                                                 {match.compatibilityScore.toFixed(4)}
                                                             </td>
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{match.scores.color.toFixed(3)}</td>
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{match.scores.gabor.toFixed(3)}</td>
                                                             <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{match.scores.cnn.toFixed(3)}</td>
+                                                            <td style={{ padding: '6px', border: '1px solid #ddd', textAlign: 'center' }}>{(match.scores.pixel ?? 0).toFixed(3)}</td>
                                                         </tr>
                                                     ))}
                                                 </tbody>
@@ -394,7 +521,17 @@ export default function AdjacencyMatrixViewer() {
                                 Green = high compatibility, Red = low compatibility.
                             </p>
 
-                            <HeatmapVisualization adjacencyData={adjacencyData} />
+                            {!adjacencyData.matrixId ? (
+                                <p style={{ color: 'orange', fontSize: '13px' }}>
+                                    Το matrix δεν αποθηκεύτηκε στο backend (δεν χωράει στο shared store) - το heatmap χρειάζεται το query API.
+                                </p>
+                            ) : tilePairs?.matrixId === adjacencyData.matrixId ? (
+                                <HeatmapVisualization totalTiles={adjacencyData.totalTiles} tilePairScores={tilePairs.scores} />
+                            ) : (
+                                <p style={{ color: tilePairsError ? 'red' : '#666', fontSize: '13px' }}>
+                                    {tilePairsError ? `Error: ${tilePairsError}` : 'Φόρτωση των scores από το query API...'}
+                                </p>
+                            )}
                         </div>
                     )}
 
@@ -407,7 +544,9 @@ export default function AdjacencyMatrixViewer() {
                                 Ο solver ξεκινάει από ένα τυχαίο tile και τοποθετεί τα υπόλοιπα με βάση τα υψηλότερα compatibility scores.
                             </p>
 
-                            <PuzzleReconstruction adjacencyData={adjacencyData} shuffleData={shuffleData} />
+                            <MatrixGuard adjacencyData={adjacencyData} error={matrixError}>
+                                <PuzzleReconstruction adjacencyData={adjacencyData} shuffleData={shuffleData} />
+                            </MatrixGuard>
                         </div>
                     )}
                 </>
@@ -416,28 +555,22 @@ export default function AdjacencyMatrixViewer() {
     )
 }
 
-// Heatmap Component
-function HeatmapVisualization({ adjacencyData }) {
-    const { totalTiles, adjacencyMatrix } = adjacencyData
-
-    // Calculate average compatibility for each tile pair
-    const tileScores = {}
-
-    adjacencyMatrix.forEach(match => {
-        const key = `${match.tileA}-${match.tileB}`
-        if (!tileScores[key]) {
-            tileScores[key] = []
-        }
-        tileScores[key].push(match.compatibilityScore)
-    })
+// Views που χρειάζονται το adjacencyMatrix: μήνυμα αντί για crash όσο λείπει
+function MatrixGuard({ adjacencyData, error, children }) {
+    if (adjacencyData.adjacencyMatrix) return children
 
-    // Create average scores
-    const avgScores = {}
-    for (const key in tileScores) {
-        const scores = tileScores[key]
-        avgScores[key] = scores.reduce((a, b) => a + b, 0) / scores.length
-    }
+    return (
+        <p style={{ color: error ? 'red' : '#666', fontSize: '13px' }}>
+            {error
+                ? `Το response δεν περιέχει τη λίστα των matches και η φόρτωσή της από το query API (/api/adjacency/${adjacencyData.matrixId}/top-matches) απέτυχε: ${error}. Χρησιμοποίησε το Matches view ή υπολόγισε ξανά το matrix.`
+                : 'Φόρτωση των top matches από το query API...'}
+        </p>
+    )
+}
 
+// Heatmap Component
+// tilePairScores: μέσο compatibility ανά (tileA, tileB) από το /api/adjacency/{matrixId}/tile-pairs
+function HeatmapVisualization({ totalTiles, tilePairScores }) {
     const cellSize = 50
     const fontSize = 10
 
@@ -455,11 +588,7 @@ function HeatmapVisualization({ adjacencyData }) {
                 {/* Grid cells */}
                 {Array.from({ length: totalTiles }).map((_, i) =>
                     Array.from({ length: totalTiles }).map((_, j) => {
-                        const key = `${i}-${j}`
-                        const scores = tileScores[key] || []
-                        const avgScore = scores.length > 0
-                            ? scores.reduce((a, b) => a + b, 0) / scores.length
-                            : 0
+                        const avgScore = tilePairScores[i][j] ?? 0
 
                         const color = i === j ? '#888' : getColorForScore(avgScore)
 
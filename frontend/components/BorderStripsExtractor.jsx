@@ -5,6 +5,8 @@ export default function BorderStripsExtractor() {
     const { file, shuffleData, setHistogramData } = useContext(AppContext)
     const [borderWidth, setBorderWidth] = useState(5)
     const [bins, setBins] = useState(16)
+    const [cnnFeatures, setCnnFeatures] = useState(true)
+    const [cnnDim, setCnnDim] = useState(0)
     const [imageLoaded, setImageLoaded] = useState(false)
     const [borderStrips, setBorderStrips] = useState(null)
     const imageRef = useRef(new Image())
@@ -144,6 +146,9 @@ export default function BorderStripsExtractor() {
             formData.append('gridSize', shuffleData.gridSize.toString())
             formData.append('borderWidth', borderWidth.toString())
             formData.append('bins', bins.toString())
+            formData.append('cnnFeatures', cnnFeatures.toString())
+            formData.append('cnnDim', cnnDim.toString())
+            formData.append('cnnPrecision', cnnDim > 0 ? 'float16' : 'float32')
             formData.append('tiles', JSON.stringify(shuffleData.tiles))
 
             console.log('Sending to backend:', {
@@ -167,10 +172,13 @@ export default function BorderStripsExtractor() {
                 // Αποθήκευση των histogram data στο Context
                 setHistogramData(data)
 
-                alert(`Success! Saved ${data.totalImages} border strip images and calculated:\n- Color Histograms\n- Gabor Texture Features\n- Deep CNN Features (MobileNetV2)\nfor ${data.totalTiles} tiles`)
+                const downgrades = data.admission && data.admission.downgrades.length > 0
+                    ? `\n\nRequest downgraded to fit the server budget: ${data.admission.downgrades.join(', ')}`
+                    : ''
+                alert(`Success! Saved ${data.totalImages} border strip images and calculated:\n- Color Histograms\n- Gabor Texture Features\n- Deep CNN Features (MobileNetV2)\nfor ${data.totalTiles} tiles${downgrades}`)
             } else {
                 console.error('Backend error:', data)
-                alert('Error saving border strips')
+                alert(data.admission ? `Request rejected: ${data.message}` : 'Error saving border strips')
             }
 
         } catch (error) {
@@ -222,6 +230,41 @@ export default function BorderStripsExtractor() {
                 </span>
             </section>
 
+            <section style={{ marginTop: '10px' }}>
+                <label htmlFor="cnnFeatures">
+                    <input
+                        type="checkbox"
+                        name="cnnFeatures"
+                        id="cnnFeatures"
+                        checked={cnnFeatures}
+                        onChange={(e) => setCnnFeatures(e.target.checked)}
+                    />
+                    CNN Features (MobileNetV2)
+                </label>
+                <span style={{ marginLeft: '10px', fontSize: '12px', color: '#666' }}>
+                    Χωρίς CNN = πολύ πιο γρήγορο (χρησιμοποίησε το Pixel weight στο Adjacency Matrix)
+                </span>
+            </section>
+
+            <section style={{ marginTop: '10px' }}>
+                <label htmlFor="cnnDim">CNN embedding: </label>
+                <select
+                    name="cnnDim"
+                    id="cnnDim"
+                    value={cnnDim}
+                    disabled={!cnnFeatures}
+                    onChange={(e) => setCnnDim(parseInt(e.target.value))}
+                >
+                    <option value={0}>Πλήρες (float32)</option>
+                    <option value={128}>PCA 128 (float16)</option>
+                    <option value={64}>PCA 64 (float16)</option>
+                    <option value={32}>PCA 32 (float16)</option>
+                </select>
+                <span style={{ marginLeft: '10px', fontSize: '12px', color: '#666' }}>
+                    Συμπιεσμένα vectors = πολύ μικρότερο payload και ταχύτερο Adjacency Matrix
+                </span>
+            </section>
+
             <section>
                 <button
                     onClick={extractBorderStrips}
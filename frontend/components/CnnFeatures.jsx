@@ -45,6 +45,17 @@ export default function CnnFeatures() {
         )
     }
 
+    if (currentTile.tileCnnFeatures.length === 0) {
+        return (
+            <div>
+                <h2>Deep CNN Features (MobileNetV2)</h2>
+                <p style={{ color: 'orange' }}>
+                    Τα CNN features δεν υπολογίστηκαν (CNN Features απενεργοποιημένα στο Send to Backend).
+                </p>
+            </div>
+        )
+    }
+
     return (
         <div style={{ padding: '20px', backgroundColor: '#f5f5f5', borderRadius: '8px', marginTop: '20px' }}>
             <h2 style={{ color: '#333', borderBottom: '2px solid #FF5722', paddingBottom: '10px' }}>
@@ -209,10 +220,10 @@ export default function CnnFeatures() {
                         </select>
 
                         <div style={{ marginTop: '15px', padding: '10px', backgroundColor: '#fff', borderRadius: '5px', fontFamily: 'monospace', fontSize: '11px', maxHeight: '150px', overflowY: 'auto' }}>
-                            <strong>Feature Vector ({currentTile.tileCnnFeatures[selectedLayer].num_channels} διαστάσεων):</strong>
+                            <strong>Feature Vector ({currentTile.tileCnnFeatures[selectedLayer].feature_vector.length} διαστάσεων):</strong>
                             <div style={{ marginTop: '8px', wordBreak: 'break-all' }}>
                                 [{currentTile.tileCnnFeatures[selectedLayer].feature_vector.slice(0, 20).map(v => v.toFixed(4)).join(', ')}...
-                                (showing first 20 of {currentTile.tileCnnFeatures[selectedLayer].num_channels} values)]
+                                (showing first 20 of {currentTile.tileCnnFeatures[selectedLayer].feature_vector.length} values)]
                             </div>
                         </div>
 
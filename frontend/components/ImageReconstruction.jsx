@@ -2,7 +2,7 @@ import { useContext, useRef, useState, useEffect } from "react"
 import { AppContext } from "../src/App"
 
 export default function ImageReconstruction() {
-    const { file, shuffleData, adjacencyData, histogramData } = useContext(AppContext)
+    const { file, shuffleData, adjacencyData, setAdjacencyData, histogramData } = useContext(AppContext)
 
     const greedyCanvasRef = useRef(null)
     const annealingCanvasRef = useRef(null)
@@ -20,6 +20,9 @@ export default function ImageReconstruction() {
         coolingRate: 0.95,
         iterations: 1000
     })
+    const [liveProgress, setLiveProgress] = useState(null) // Progress του server-side solver
+    const [liveRunning, setLiveRunning] = useState(false) // Το ref δεν προκαλεί re-render - το κουμπί οδηγείται από αυτό
+    const liveSocketRef = useRef(null)
 
     // Load image
     useEffect(() => {
@@ -32,10 +35,10 @@ export default function ImageReconstruction() {
     }, [file])
 
     // Greedy Puzzle Solver (όπως στο AdjacencyMatrixViewer)
-    const solvePuzzle = () => {
+    const solvePuzzle = (adjacencyMatrix) => {
         if (!adjacencyData || !shuffleData) return null
 
-        const { adjacencyMatrix, gridSize, totalTiles } = adjacencyData
+        const { gridSize, totalTiles } = adjacencyData
         const grid = Array(gridSize).fill(null).map(() => Array(gridSize).fill(null))
         const usedTiles = new Set()
 
@@ -161,10 +164,10 @@ export default function ImageReconstruction() {
     }
 
     // Simulated Annealing Solver
-    const solveWithSimulatedAnnealing = () => {
+    const solveWithSimulatedAnnealing = (adjacencyMatrix) => {
         if (!adjacencyData || !shuffleData) return null
 
-        const { adjacencyMatrix, gridSize, totalTiles } = adjacencyData
+        const { gridSize, totalTiles } = adjacencyData
 
         // Helper: Calculate total energy (cost) of a configuration
         const calculateEnergy = (grid) => {
@@ -523,10 +526,38 @@ export default function ImageReconstruction() {
         })
     }
 
+    // Η λίστα των top matches για τους client-side solvers. Αν το response του adjacency
+    // matrix δεν την περιέχει (includeMatrix=false ή downgrade "noMatrixInResponse") τη
+    // φέρνουμε μία φορά από το query API και την κρατάμε στο context
+    const loadAdjacencyMatrix = async () => {
+        if (!adjacencyData) return null
+        if (adjacencyData.adjacencyMatrix) return adjacencyData.adjacencyMatrix
+
+        try {
+            const params = new URLSearchParams({ k: adjacencyData.topK })
+            const response = await fetch(`/api/adjacency/${adjacencyData.matrixId}/top-matches?${params}`)
+            const data = await response.json()
+            if (data.status !== 'success') {
+                console.error('Backend error:', data)
+                alert('Error: ' + data.message + '\nΥπολόγισε ξανά το Adjacency Matrix ή χρησιμοποίησε το Live Annealing (Server).')
+                return null
+            }
+            setAdjacencyData({ ...adjacencyData, adjacencyMatrix: data.matches })
+            return data.matches
+        } catch (error) {
+            console.error('Network error:', error)
+            alert('Network error: ' + error.message)
+            return null
+        }
+    }
+
     // Greedy Reconstruct button handler
-    const handleGreedyReconstruct = () => {
+    const handleGreedyReconstruct = async () => {
+        const adjacencyMatrix = await loadAdjacencyMatrix()
+        if (!adjacencyMatrix) return
+
         console.log('Starting Greedy Solver...')
-        const grid = solvePuzzle()
+        const grid = solvePuzzle(adjacencyMatrix)
         if (grid) {
             setGreedyGrid(grid)
             const acc = calculateAccuracy(grid)
@@ -537,9 +568,12 @@ export default function ImageReconstruction() {
     }
 
     // Simulated Annealing Reconstruct button handler
-    const handleAnnealingReconstruct = () => {
+    const handleAnnealingReconstruct = async () => {
+        const adjacencyMatrix = await loadAdjacencyMatrix()
+        if (!adjacencyMatrix) return
+
         console.log('Starting Simulated Annealing Solver...')
-        const grid = solveWithSimulatedAnnealing()
+        const grid = solveWithSimulatedAnnealing(adjacencyMatrix)
         if (grid) {
             setAnnealingGrid(grid)
             const acc = calculateAccuracy(grid)
@@ -549,6 +583,84 @@ export default function ImageReconstruction() {
         }
     }
 
+    // Live Simulated Annealing στο backend (WebSocket) - best-so-far grid σε κάθε βελτίωση
+    const handleLiveAnnealing = () => {
+        if (!adjacencyData?.matrixId) {
+            alert('Πρέπει πρώτα να υπολογίσεις το Adjacency Matrix!')
+            return
+        }
+        if (liveSocketRef.current) return
+
+        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+        const socket = new WebSocket(`${protocol}://${window.location.host}/api/ws/solve`)
+        liveSocketRef.current = socket
+        setLiveRunning(true)
+
+        socket.onopen = () => {
+            socket.send(JSON.stringify({
+                type: 'start',
+                matrixId: adjacencyData.matrixId,
+                initialTemp: annealingParams.initialTemp,
+                coolingRate: annealingParams.coolingRate,
+                iterations: annealingParams.iterations,
+                progressInterval: Math.max(1, Math.floor(annealingParams.iterations / 50))
+            }))
+        }
+
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data)
+
+            if (message.type === 'error') {
+                console.error('Live solver error:', message)
+                alert('Error: ' + message.message)
+                return
+            }
+
+            setLiveProgress(message)
+            if (message.bestGrid) {
+                setAnnealingGrid(message.bestGrid)
+                setAnnealingAccuracy(calculateAccuracy(message.bestGrid))
+            }
+            if (message.type === 'done') {
+                console.log(`Live annealing ${message.reason} at iteration ${message.iteration}, best energy ${message.bestEnergy.toFixed(4)}`)
+            }
+        }
+
+        socket.onclose = () => {
+            liveSocketRef.current = null
+            setLiveRunning(false)
+            setLiveProgress(progress => progress ? { ...progress, running: false } : progress)
+        }
+    }
+
+    const stopLiveAnnealing = () => {
+        const socket = liveSocketRef.current
+        if (!socket) return
+        // Πριν το onopen δεν υπάρχει session για να σταματήσει - απλά κλείνει
+        if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'stop' }))
+        } else {
+            socket.close()
+        }
+    }
+
+    // Αλλαγή cooling rate ενώ τρέχει ο live solver
+    const handleCoolingRateChange = (coolingRate) => {
+        setAnnealingParams({ ...annealingParams, coolingRate })
+        if (liveSocketRef.current?.readyState === WebSocket.OPEN) {
+            liveSocketRef.current.send(JSON.stringify({ type: 'update', coolingRate }))
+        }
+    }
+
+    // Κλείσιμο του WebSocket όταν φεύγει το component
+    useEffect(() => {
+        return () => {
+            if (liveSocketRef.current) {
+                liveSocketRef.current.close()
+            }
+        }
+    }, [])
+
     // Draw images when data changes
     useEffect(() => {
         if (imageLoaded) {
@@ -676,7 +788,7 @@ export default function ImageReconstruction() {
                                     max="0.99"
                                     step="0.01"
                                     value={annealingParams.coolingRate}
-                                    onChange={(e) => setAnnealingParams({...annealingParams, coolingRate: parseFloat(e.target.value)})}
+                                    onChange={(e) => handleCoolingRateChange(parseFloat(e.target.value))}
                                     style={{ width: '100%' }}
                                 />
                             </label>
@@ -709,6 +821,34 @@ export default function ImageReconstruction() {
                         >
                             Run Simulated Annealing
                         </button>
+
+                        <button
+                            onClick={liveRunning ? stopLiveAnnealing : handleLiveAnnealing}
+                            disabled={!adjacencyData.matrixId}
+                            style={{
+                                padding: '12px 24px',
+                                fontSize: '14px',
+                                fontWeight: 'bold',
+                                backgroundColor: liveRunning ? '#f44336' : '#795548',
+                                color: 'white',
+                                border: 'none',
+                                borderRadius: '5px',
+                                cursor: 'pointer',
+                                marginLeft: '10px'
+                            }}
+                        >
+                            {liveRunning ? 'Stop Live Annealing' : 'Live Annealing (Server)'}
+                        </button>
+
+                        {liveProgress && (
+                            <p style={{ fontSize: '12px', color: '#666', fontFamily: 'monospace' }}>
+                                Iteration {liveProgress.iteration}/{liveProgress.iterations ?? liveProgress.iteration}
+                                {liveProgress.temperature !== undefined && ` | Temp: ${liveProgress.temperature.toFixed(4)}`}
+                                {liveProgress.currentEnergy !== undefined && ` | Energy: ${liveProgress.currentEnergy.toFixed(4)}`}
+                                {` | Best: ${liveProgress.bestEnergy.toFixed(4)}`}
+                                {liveProgress.type === 'done' && ` (${liveProgress.reason})`}
+                            </p>
+                        )}
                     </div>
                 </div>
             </div>